@@ -1,6 +1,6 @@
-import csv
 from csearch.helpers.bm25_helper import BM25Helper
-from gensim.summarization.bm25 import BM25
+from csearch.helpers.file_helper import FileHelper
+from csearch.helpers.training_set_tsv_reader import TrainingSetTsvReader
 import scipy.stats as ss
 from tqdm import tqdm
 import numpy as np
@@ -9,49 +9,32 @@ import itertools as it
 from multiprocessing import Pool
 
 
-def load_corpus(filename: str):
-    filereader = csv.reader(open(filename, 'r'), delimiter='\t')
-    data = [row for row in filereader]
-    return data, ['.'.join(conversation[1:-1]) for conversation in data if conversation[0] == '1']
-
-
-def get_score_custom(document, index, bm25_model: BM25, k1, b):
-    """Computes BM25 score of given `document` in relation to item of corpus selected by `index`.
-
-    Parameters
-    ----------
-    document : list of str
-        Document to be scored.
-    index : int
-        Index of document in corpus selected to score with `document`.
-
-    Returns
-    -------
-    float
-        BM25 score.
-c
+def load_corpus(reader: TrainingSetTsvReader) -> list:
+    """
+    Returns the context of each positive row, with its utterances joined
+    :param reader:
+    :return:
     """
-    score = 0
-    doc_freqs = bm25_model.doc_freqs[index]
-    for word in document:
-        if word not in doc_freqs:
-            continue
-        score += (bm25_model.idf[word] * doc_freqs[word] * (k1 + 1)
-                  / (doc_freqs[word] + k1 * (1 - b + b * bm25_model.doc_len[index] / bm25_model.avgdl)))
-    return score
+    return [
+        '.'.join(reader.get_row(reader.get_context_range(index)[0])[1:-1])
+        for index in range(reader.get_contexts_count())
+    ]
 
 
 def worker(work_num):
     entry = combinations[work_num]
     print('Combination ' + str(work_num + 1) + '/' + str(len(combinations)))
     print(entry)
-    for i, grouped_responses in enumerate(responses):
+    ranks = []
+    for i in range(reader.get_contexts_count()):
+        # The true response and the first 9 negative ones, read from the memory-mapped file
+        grouped_responses = [row[-1] for row in reader.get_context(i, 10)]
         scores = []
         for response in grouped_responses:
             preprocessed_response = helper.bm25_pre_process_utterance(response)
             k1 = entry['k1']
             b = entry['b']
-            score = get_score_custom(preprocessed_response, i, helper.model, k1, b)
+            score = helper.model.get_score(preprocessed_response, i, k1=k1, b=b)
             # scores.append(-helper.model.get_score(preprocessed_response, i))
             scores.append(-score)
         ranks.append(ss.rankdata(scores)[0])
@@ -67,27 +50,21 @@ def worker(work_num):
 if __name__ == '__main__':
     # _, train_context_corpus = load_corpus('stackexchange_dump/data_train_easy.tsv')
     # _, dev_context_corpus = load_corpus('stackexchange_dump/data_dev_easy.tsv')
-    data, test_context_corpus = load_corpus('stackexchange_dump/data_test_easy.tsv')
+    corpus_file = 'stackexchange_dump/data_test_easy.tsv'
+    reader = TrainingSetTsvReader(corpus_file)
+    test_context_corpus = load_corpus(reader)
     # data, test_context_corpus = load_corpus('stackexchange_dump/data_test_easy.tsv')
     # responses = [conversation[-1] for conversation in data]
     # index_offset = len(train_context_corpus + dev_context_corpus)
     # helper = BM25Helper(train_context_corpus + dev_context_corpus + test_context_corpus)
 
-    ranks = []
-    responses = []
-    current_grouped_responses = []
-
-    helper = BM25Helper(test_context_corpus)
+    # Persisted next to the training indexes, so later runs (and every parameter combination) reuse it
+    helper = BM25Helper(
+        test_context_corpus,
+        index_folder='stackexchange_dump/bm25_index/contexts_' + FileHelper.get_files_hash([corpus_file])
+    )
     del test_context_corpus
 
-    for index, conversation in enumerate(data):
-        if conversation[0] == '1' and index > 0:
-            responses.append(current_grouped_responses[0:10])
-            current_grouped_responses = []
-        current_grouped_responses.append(conversation[-1])
-
-    del data
-
     param_grid = {
         'k1': [0.5, 0.7, 0.9, 1.1, 1.3, 1.5, 1.7, 1.9, 2.1],
         'b': [0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8],
@@ -1,70 +1,64 @@
-import csv
 from csearch.helpers.bm25_helper import BM25Helper
+from csearch.helpers.training_set_tsv_reader import TrainingSetTsvReader
 from statistics import mean
 import scipy.stats as ss
 from tqdm import tqdm
 import math
-import copy
 
-def load_corpus(filename: str):
-    filereader = csv.reader(open(filename, 'r'), delimiter='\t')
-    data = [row for row in filereader]
+def load_corpus(reader: TrainingSetTsvReader):
+    """
+    Groups the consecutive contexts with the same utterances (one per true document of the same dialogue turn)
+    :param reader:
+    :return: The distinct contexts, with their utterances joined, and the positions of the contexts of each group
+    """
     test_context_corpus = []
-    last_context = '.'.join(data[0][1:-1])
-    test_context_corpus.append(last_context)
+    context_groups = []
 
-    for index, conversation in enumerate(data):
-        current_context = '.'.join(conversation[1:-1])
+    for index in range(reader.get_contexts_count()):
+        current_context = '.'.join(reader.get_row(reader.get_context_range(index)[0])[1:-1])
 
-        if conversation[0] == '1' and index > 0 and current_context != last_context:
+        if not test_context_corpus or current_context != test_context_corpus[-1]:
             test_context_corpus.append(current_context)
-            last_context = copy.deepcopy(current_context)
+            context_groups.append([])
 
-    return data, test_context_corpus
+        context_groups[-1].append(index)
+
+    return test_context_corpus, context_groups
 
 
 if __name__ == '__main__':
     # _, train_context_corpus = load_corpus('stackexchange_dump/data_train_easy.tsv')
     # _, dev_context_corpus = load_corpus('stackexchange_dump/data_dev_easy.tsv')
     # data, test_context_corpus = load_corpus('stackexchange_dump/data_test_easy.tsv')
-    _, train_context_corpus = load_corpus('stackexchange_dump/mantis_web/data_test_easy_corrected.tsv')
+    reader = TrainingSetTsvReader('stackexchange_dump/mantis_web/data_test_easy_corrected.tsv')
+    train_context_corpus, context_groups = load_corpus(reader)
     # responses = [conversation[-1] for conversation in data]
     # index_offset = len(train_context_corpus + dev_context_corpus)
     # helper = BM25Helper(train_context_corpus + dev_context_corpus + test_context_corpus)
 
     all_ranks = []
-    responses = []
-    true_docs_per_group = []
-    current_true_responses = []
-    current_negative_responses = []
 
     helper = BM25Helper(train_context_corpus)
     del train_context_corpus
-    test_data, test_context_corpus = load_corpus('stackexchange_dump/mantis_web/data_test_easy_corrected.tsv')
-    last_context = '.'.join(test_data[0][1:-1])
-
-    for index, conversation in enumerate(test_data):
-        current_context = '.'.join(conversation[1:-1])
 
-        if conversation[0] == '1' and index > 0 and current_context != last_context:
-            responses.append(current_true_responses + current_negative_responses[0:(10 - len(current_true_responses))])
-            true_docs_per_group.append(len(current_true_responses))
+    with tqdm(total=len(context_groups)) as pbar:
+        for i, context_indexes in enumerate(context_groups):
             current_true_responses = []
             current_negative_responses = []
-            last_context = copy.deepcopy(current_context)
 
-        if conversation[0] == '1':
-            current_true_responses.append(conversation[-1])
-        else:
-            current_negative_responses.append(conversation[-1])
+            # At most 10 responses are ranked, so the first 10 rows of each context are enough
+            for context_index in context_indexes:
+                rows = reader.get_context(context_index, 10)
+                current_true_responses.append(rows[0][-1])
+                current_negative_responses += [row[-1] for row in rows[1:]]
 
-    with tqdm(total=len(responses)) as pbar:
-        for i, grouped_responses in enumerate(responses):
+            grouped_responses = current_true_responses + \
+                current_negative_responses[0:(10 - len(current_true_responses))]
             scores = []
             for response in grouped_responses:
                 preprocessed_response = helper.bm25_pre_process_utterance(response)
                 scores.append(-helper.model.get_score(preprocessed_response, i))
-            true_docs_ranks = ss.rankdata(scores)[0:true_docs_per_group[i]]
+            true_docs_ranks = ss.rankdata(scores)[0:len(current_true_responses)]
             true_docs_ranks.sort()
             all_ranks.append(true_docs_ranks)
             pbar.update(1)
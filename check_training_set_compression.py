@@ -0,0 +1,140 @@
+from csearch.helpers.file_helper import FileHelper
+from csearch.helpers.training_set_tsv_reader import TrainingSetTsvReader
+import tempfile
+import shutil
+import gzip
+import sys
+import os
+
+
+def get_sample_rows(contexts_count: int) -> tuple:
+    """
+    Builds the rows of a small training set, with a positive and two negative rows per context
+    :param contexts_count:
+    :return: The tsv rows and the dialogue ID of each row
+    """
+    rows = []
+    dialogue_ids = []
+
+    for context in range(contexts_count):
+        utterances = ['question ' + str(context) + ' about the MacBook', 'réponse "quoted" ünïcode €']
+        for label, response in [(1, 'the true answer'), (0, 'a negative answer'), (0, 'another negative answer')]:
+            rows.append([label] + utterances + [response + ' ' + str(context)])
+            dialogue_ids.append(context // 2)
+
+    return rows, dialogue_ids
+
+
+def write_sample(file_location: str, compression: str, rows: list, dialogue_ids: list) -> FileHelper:
+    """
+    Writes the rows as JSON2Training does: with a small buffer, in two sessions (the second one appending, as when a
+    build is resumed), and with a shard appended at the end (see FileHelper.append_file)
+    :param file_location:
+    :param compression:
+    :param rows:
+    :param dialogue_ids:
+    :return: The helper of the files
+    """
+    file_helper = FileHelper(file_location, compression, buffer_size=256)
+    shard_helper = file_helper.get_shard_helper(0)
+    first_end, shard_start = len(rows) // 3, 2 * len(rows) // 3
+
+    for helper, start, end, append in [(file_helper, 0, first_end, False), (file_helper, first_end, shard_start, True),
+                                       (shard_helper, shard_start, len(rows), False)]:
+        helper.open('.tsv', append)
+        helper.open('_lookup.txt', append)
+        for row, dialogue_id in zip(rows[start:end], dialogue_ids[start:end]):
+            helper.write_rows('.tsv', [row])
+            helper.write_lines('_lookup.txt', [dialogue_id])
+        helper.close()
+
+    for suffix in ['.tsv', '_lookup.txt']:
+        file_helper.append_file(suffix, shard_helper)
+
+    return file_helper
+
+
+def read_content(file_helper: FileHelper, suffix: str) -> bytes:
+    """
+    Returns the decompressed content of a file written by a helper
+    :param file_helper:
+    :param suffix:
+    :return:
+    """
+    file_name = file_helper.get_output_name(suffix)
+
+    if file_helper.compression == 'gzip':
+        with gzip.open(file_name, 'rb') as f:
+            return f.read()
+
+    if file_helper.compression == 'zstd':
+        import zstandard
+        with zstandard.open(file_name, 'rb') as f:
+            return f.read()
+
+    with open(file_name, 'rb') as f:
+        return f.read()
+
+
+def is_rejected(file_name: str) -> bool:
+    """
+    Whether TrainingSetTsvReader refuses to read a file
+    :param file_name:
+    :return:
+    """
+    try:
+        TrainingSetTsvReader(file_name)
+    except ValueError as error:
+        print('    rejected: ' + str(error))
+        return True
+
+    return False
+
+
+if __name__ == '__main__':
+    # Checks the compressed outputs of FileHelper (gzip and, if the zstandard package is installed, zstd): once
+    # decompressed, they must hold the same bytes as the uncompressed output. Also checks that TrainingSetTsvReader
+    # reads the uncompressed training set and refuses the compressed ones, detected from their extension or from
+    # their content. Syntax: python check_training_set_compression.py [contexts_count]
+    contexts_count = int(sys.argv[1]) if len(sys.argv) >= 2 else 100
+    rows, dialogue_ids = get_sample_rows(contexts_count)
+    folder = tempfile.mkdtemp()
+    failures = []
+
+    try:
+        plain_helper = write_sample(folder + '/plain', None, rows, dialogue_ids)
+        reader = TrainingSetTsvReader(plain_helper.get_output_name('.tsv'))
+        if [reader.get_row(index) for index in range(len(reader))] != [[str(value) for value in row] for row in rows] \
+                or list(reader.iter_dialogue_ids()) != dialogue_ids:
+            failures.append('TrainingSetTsvReader does not read back the uncompressed training set')
+
+        for compression in ['gzip', 'zstd']:
+            if compression == 'zstd':
+                try:
+                    import zstandard
+                except ImportError:
+                    print('zstd: skipped, the zstandard package is not installed')
+                    continue
+
+            print(compression + ':')
+            file_helper = write_sample(folder + '/' + compression, compression, rows, dialogue_ids)
+
+            for suffix in ['.tsv', '_lookup.txt']:
+                if read_content(file_helper, suffix) != read_content(plain_helper, suffix):
+                    failures.append(compression + ': the ' + suffix + ' file differs from the uncompressed one')
+
+            # Detected from the extension, then from the content of a file without it
+            renamed_file = folder + '/' + compression + '_renamed.tsv'
+            shutil.copyfile(file_helper.get_output_name('.tsv'), renamed_file)
+
+            for file_name in [file_helper.get_output_name('.tsv'), renamed_file]:
+                if not is_rejected(file_name):
+                    failures.append(compression + ': TrainingSetTsvReader reads ' + os.path.basename(file_name))
+    finally:
+        shutil.rmtree(folder)
+
+    for failure in failures:
+        print(failure)
+
+    print(str(len(failures)) + ' checks failed')
+    exit(1 if failures else 0)
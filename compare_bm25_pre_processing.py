@@ -0,0 +1,53 @@
+from csearch.helpers.bm25_tokenizer import BM25Tokenizer
+import numpy as np
+import spacy
+import json
+import sys
+
+
+def load_texts(json_files: list) -> list:
+    """
+    Returns all the utterances of the given JSON datasets: the agent responses (the BM25 corpus) and the user
+    utterances (the queries), in order
+    :param json_files:
+    :return:
+    """
+    texts = []
+
+    for json_file in json_files:
+        with open(json_file, 'r') as f:
+            json_data = json.load(f)
+
+        for dialogue in json_data.values():
+            texts += [utterance['utterance'] for utterance in dialogue['utterances']]
+
+    return texts
+
+
+if __name__ == '__main__':
+    # Checks that the tokenizer-only BM25 pre-processing gives the same terms as the original one, which ran the
+    # spaCy pipeline (tok2vec, attribute_ruler and lemmatizer, with parser, tagger and ner disabled) before filtering
+    # the tokens. Syntax: python compare_bm25_pre_processing.py [json_files] [sample_size] [model]
+    json_files = sys.argv[1].split(',') if len(sys.argv) >= 2 else \
+        ['stackexchange_dump/merged_train.json', 'stackexchange_dump/merged_dev.json']
+    sample_size = int(sys.argv[2]) if len(sys.argv) >= 3 else 10000
+    model = sys.argv[3] if len(sys.argv) >= 4 else 'en_core_web_sm'
+
+    texts = load_texts(json_files)
+    positions = np.random.default_rng(10).choice(len(texts), min(sample_size, len(texts)), replace=False)
+    sample = [texts[position] for position in sorted(positions.tolist())]
+    del texts
+
+    pipeline = spacy.load(model, disable=["parser", "tagger", "ner"])
+    print('Comparing the pre-processing of ' + str(len(sample)) + ' texts with the pipeline ' +
+          ', '.join(pipeline.pipe_names))
+
+    mismatches = BM25Tokenizer(pipeline=pipeline).compare_pre_processing(sample)
+
+    for position, pipeline_terms, tokenizer_terms in mismatches:
+        print('Text ' + str(position) + ':')
+        print('    pipeline only:  ' + str([term for term in pipeline_terms if term not in tokenizer_terms]))
+        print('    tokenizer only: ' + str([term for term in tokenizer_terms if term not in pipeline_terms]))
+
+    print(str(len(mismatches)) + ' of ' + str(len(sample)) + ' texts are pre-processed differently')
+    exit(1 if mismatches else 0)
@@ -1,16 +1,74 @@
 from csearch.converters.xml2pandas import XML2Pandas
 from csearch.converters.pandas2json import Pandas2JSON
 from csearch.helpers.dataset_helper import DatasetHelper
+from csearch.helpers.dump_cache_helper import DumpCacheHelper
+from csearch.helpers.json_dataset_writer import JsonDatasetWriter
 from pandas import DataFrame
 import pandas as pd
-import json
+
+# Attributes of each dump file that are needed to build the dialogues, together with their types in the cache.
+# Everything else is dropped while parsing
+DUMP_FILES = {
+    'Posts': {
+        'columns': ['Id', 'PostTypeId', 'ParentId', 'AcceptedAnswerId', 'CreationDate', 'Score', 'Body',
+                    'OwnerUserId', 'Title'],
+        'dtypes': {'Id': 'integer', 'PostTypeId': 'category', 'ParentId': 'integer', 'CreationDate': 'datetime',
+                   'OwnerUserId': 'integer'},
+    },
+    'Comments': {
+        'columns': ['Id', 'PostId', 'Score', 'Text', 'CreationDate', 'UserId'],
+        'dtypes': {'Id': 'integer', 'PostId': 'integer', 'CreationDate': 'datetime', 'UserId': 'integer'},
+    },
+    'Votes': {
+        'columns': ['PostId', 'VoteTypeId'],
+        'dtypes': {'PostId': 'integer', 'VoteTypeId': 'category'},
+        # Only the votes marking a post as spam (12) or offensive (4) are used
+        'row_filter': ('VoteTypeId', ['4', '12']),
+    },
+    'Users': {
+        'columns': ['Id', 'DisplayName'],
+        'dtypes': {'Id': 'integer'},
+    },
+}
 
 
 class StackExchangeJSONBuilder:
 
-    def __init__(self, folder, topic):
+    def __init__(self, folder, topic, use_cache: bool = True, num_workers: int = 1):
         self.__root_folder = folder
         self.__topic = topic
+        self.__use_cache = use_cache
+        self.__num_workers = num_workers
+        self.__dump_cache_helper = DumpCacheHelper(folder)
+
+    def __parse_dump_file(self, name: str) -> DataFrame:
+        """
+        Parses one of the dump files, keeping only the necessary columns (and rows), and types its columns
+        :param name: Name of the dump file, without extension
+        :return:
+        """
+        dump_file = DUMP_FILES[name]
+
+        row_filter = None
+        if 'row_filter' in dump_file:
+            filter_column, allowed_values = dump_file['row_filter'][0], set(dump_file['row_filter'][1])
+            row_filter = lambda row: row.get(filter_column) in allowed_values
+
+        df = XML2Pandas(self.__root_folder + '/' + name + '.xml', dump_file['columns'], row_filter=row_filter).convert()
+
+        return DumpCacheHelper.apply_dtypes(df, dump_file['dtypes'])
+
+    def __load_dump_file(self, name: str) -> DataFrame:
+        """
+        Loads one of the dump files as a typed DataFrame. Unless caching is disabled, the columnar cache written by a
+        previous run is used as long as the XML file did not change
+        :param name: Name of the dump file, without extension
+        :return:
+        """
+        if not self.__use_cache:
+            return self.__parse_dump_file(name)
+
+        return self.__dump_cache_helper.load(name, DUMP_FILES[name], lambda: self.__parse_dump_file(name))
 
     def __generate_dataframe(self) -> DataFrame:
         """
@@ -19,37 +77,18 @@ class StackExchangeJSONBuilder:
         :return:
         """
         print('Fetching XML files from ' + self.__root_folder)
-        # Generate the dataframe for posts and comments
-        posts_df = XML2Pandas(self.__root_folder + '/Posts.xml').convert()
-        comments_df = XML2Pandas(self.__root_folder + '/Comments.xml').convert()
-        votes_df = XML2Pandas(self.__root_folder + '/Votes.xml').convert()
-        users_df = XML2Pandas(self.__root_folder + '/Users.xml').convert()
-        spam_votes_df = votes_df.loc[votes_df['VoteTypeId'].isin(['4', '12'])].copy()
-
-        # Convert necessary columns to numeric
-        posts_df['Id'] = pd.to_numeric(posts_df['Id'], downcast='integer')
-        posts_df['OwnerUserId'] = pd.to_numeric(posts_df['OwnerUserId'], downcast='integer')
-        posts_df['ParentId'] = pd.to_numeric(posts_df['ParentId'], downcast='integer')
-
-        comments_df['Id'] = pd.to_numeric(comments_df['Id'], downcast='integer')
-        comments_df['PostId'] = pd.to_numeric(comments_df['PostId'], downcast='integer')
-        comments_df['UserId'] = pd.to_numeric(comments_df['UserId'], downcast='integer')
-
-        users_df['Id'] = pd.to_numeric(users_df['Id'], downcast='integer')
-        spam_votes_df['PostId'] = pd.to_numeric(spam_votes_df['PostId'], downcast='integer')
+        # Generate the dataframe for posts and comments. Only the attributes used below are kept, already typed
+        posts_df = self.__load_dump_file('Posts')
+        comments_df = self.__load_dump_file('Comments')
+        spam_votes_df = self.__load_dump_file('Votes')
+        users_df = self.__load_dump_file('Users')
 
         print('Merging the information...')
         posts_df = posts_df.loc[~posts_df['OwnerUserId'].isnull()]
 
-        filtered_posts_df = pd.merge(
-            posts_df,
-            spam_votes_df,
-            how='left',
-            left_on='Id',
-            right_on='PostId',
-            suffixes=('_post', '_votes')
-        )
-        filtered_posts_df = filtered_posts_df.loc[filtered_posts_df['PostId'].isnull()]
+        # Throw away the posts marked as spam/offensive
+        filtered_posts_df = posts_df.loc[~posts_df['Id'].isin(spam_votes_df['PostId'])]
+        filtered_posts_df = filtered_posts_df.rename(columns={'Id': 'Id_post', 'CreationDate': 'CreationDate_post'})
 
         columns = ['AcceptedAnswerId', 'Body', 'CreationDate_post', 'Id_post', 'OwnerUserId', 'ParentId', 'PostTypeId',
                    'Score', 'Title']
@@ -68,6 +107,8 @@ class StackExchangeJSONBuilder:
                    'Score', 'Title', 'DisplayName']
         posts_users_df = posts_users_df[columns]
 
+        comments_df = comments_df.rename(columns={'CreationDate': 'CreationDate_comment'})
+
         comments_users_df = pd.merge(
             comments_df,
             users_df,
@@ -98,23 +139,43 @@ class StackExchangeJSONBuilder:
         # Sort by post creation date and then by comment
         filtered_df = filtered_df.sort_values(by=['CreationDate_post', 'CreationDate_comment'])
 
-        return filtered_df
+        # The dialogues keep the dates in the format of the dump
+        filtered_df['CreationDate_post'] = DumpCacheHelper.format_dates(filtered_df['CreationDate_post'])
+        filtered_df['CreationDate_comment'] = DumpCacheHelper.format_dates(filtered_df['CreationDate_comment'])
 
-    def __write_json(self, filename: str, data: dict) -> None:
-        with open(self.__root_folder + '/' + filename, 'w') as fp:
-            json.dump(data, fp)
+        return filtered_df
 
     def build_json(self, split: dict) -> None:
+        """
+        Streams the dialogues into data.json as they are generated, then copies the chronological train/dev/test
+        ranges of data.json into their own files. Only one dialogue (and the date of each) is held in memory
+        :param split: The train/dev/test distribution (see DatasetHelper.get_index_split)
+        :return:
+        """
         df = self.__generate_dataframe()
         print('Starting the conversion to JSON format')
-        df_json = Pandas2JSON(df, self.__topic).convert()
-
-        self.__write_json('data.json', df_json)
-
-        split_dataset = DatasetHelper.get_split_dataset(df_json, split)
-        for allocation in split_dataset.keys():
-            self.__write_json('data_' + allocation + '.json', split_dataset[allocation])
-
-
-
-
+        dialog_times = []
+
+        with JsonDatasetWriter(self.__root_folder + '/data.json') as dataset_writer:
+            for dialogue in Pandas2JSON(df, self.__topic, self.__num_workers).iter_dialogues():
+                dataset_writer.write(dialogue.as_dict())
+                dialog_times.append(dialogue.dialog_time)
+
+        index_split = DatasetHelper.get_index_split(dialog_times, split)
+        dev_start_index = index_split['dev_start_index']
+        test_start_index = index_split['test_start_index']
+
+        # Same allocation as DatasetHelper.get_split_dataset (an empty dev split leaves the rest to dev)
+        if test_start_index == dev_start_index:
+            test_start_index = len(dialog_times)
+
+        split_ranges = {
+            'train': (0, dev_start_index),
+            'dev': (dev_start_index, test_start_index),
+            'test': (test_start_index, len(dialog_times)),
+        }
+
+        for allocation, (start_index, end_index) in split_ranges.items():
+            dataset_writer.copy_range(
+                self.__root_folder + '/data_' + allocation + '.json', start_index, end_index
+            )
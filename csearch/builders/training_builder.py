@@ -1,31 +1,26 @@
 import json
-import csv
 from csearch.converters.json2training import JSON2Training
 from csearch.converters.json2training import Json2EasyTraining
-from csearch.helpers.bm25_helper import BM25Helper
 from csearch.helpers.dataset_helper import DatasetHelper
+from csearch.helpers.file_helper import FileHelper
 
 
 class TrainingSetBuilder:
-    def __init__(self, json_location):
-        self.__json_location = json_location
-
-    def __write_tsv(self, file_name: str, data: list) -> None:
+    def __init__(self, json_location, num_workers: int = 1, count_duplicates: bool = False, compression: str = None,
+                 output_format: str = 'tsv'):
         """
-        Given a filename and a list, this function writes the list in tsv format
-        :param file_name:
-        :param data:
-        :return:
+        :param json_location:
+        :param num_workers: Number of processes used to build the BM25 index and to generate the training sets
+        :param count_duplicates: Compute the BM25 statistics over the corpus with its duplicate documents, as before
+        the corpus was deduplicated (see DatasetHelper.build_corpus_bm25_helper)
+        :param compression: Compression of the training sets (see FileHelper)
+        :param output_format: Format of the training sets, tsv or binary (see JSON2Training.OUTPUT_FORMATS)
         """
-        with open(self.__json_location + '/' + file_name, 'w',) as tsv_file:
-            writer = csv.writer(tsv_file, delimiter='\t', lineterminator='\n')
-            for entry in data:
-                writer.writerow(entry)
-
-    def __write_array(self, file_name: str, data:list) -> None:
-        with open(self.__json_location + '/' + file_name, 'w') as f:
-            for entry in data:
-                f.write('%s\n' % entry)
+        self.__json_location = json_location
+        self.__num_workers = num_workers
+        self.__count_duplicates = count_duplicates
+        self.__compression = compression
+        self.__output_format = output_format
 
     def __build_bm25_helper(self, is_easy):
         allocation = ['train', 'dev']
@@ -40,34 +35,51 @@ class TrainingSetBuilder:
                 json_data_for_bm25[current_index] = dialogue
                 current_index += 1
 
+        # The index only depends on the input files, so the easy and hard builds share it
+        input_files = [self.__json_location + '/merged_' + entry + '.json' for entry in allocation]
+        index_folder = self.__json_location + '/bm25_index/responses_' + FileHelper.get_files_hash(input_files)
+
         if is_easy:
-            return DatasetHelper.build_multi_topic_bm25_helper(json_data_for_bm25)
+            return DatasetHelper.build_multi_topic_bm25_helper(
+                json_data_for_bm25, index_folder, self.__num_workers, self.__count_duplicates
+            )
 
-        return DatasetHelper.build_bm25_helper(json_data_for_bm25)
+        return DatasetHelper.build_bm25_helper(
+            json_data_for_bm25, index_folder, self.__num_workers, self.__count_duplicates
+        )
 
-    def build(self, is_easy=False) -> None:
+    def build(self, is_easy=False, resume: bool = False) -> None:
         """
         Given a json structure, this function builds a tsv containing all possible (label, context, response) triples
         that can be obtained from the dialogues
+        :param is_easy:
+        :param resume: Continue an interrupted build from its last checkpoints (see JSON2Training.convert_and_write).
+        The training sets completed by the interrupted build are not converted again
         :return:
         """
         allocation = ['train', 'dev', 'test']
 
         bm25_helper = self.__build_bm25_helper(is_easy)
+        file_helpers = []
 
         for entry in allocation:
             with open(self.__json_location + '/merged_' + entry + '.json', 'r') as f:
                 json_data = json.load(f)
 
-            output_file_name = 'data_' + entry
-            if is_easy:
-                json2training_converter = Json2EasyTraining(json_data, bm25_helper)
-                output_file_name += '_easy'
-            else:
-                json2training_converter = JSON2Training(json_data, bm25_helper)
+            suffix = '_easy' if is_easy else ''
+            file_helper = FileHelper(self.__json_location + '/data_' + entry + suffix, self.__compression)
+
+            json2training_converter = Json2EasyTraining(
+                json_data, bm25_helper, file_helper, self.__num_workers, self.__output_format
+            ) if is_easy else JSON2Training(
+                json_data, bm25_helper, file_helper, self.__num_workers, self.__output_format
+            )
+
+            del json_data
 
-            training_set = json2training_converter.convert()
-            dialog_lookup_table = json2training_converter.get_dialog_lookup_table()
+            json2training_converter.convert_and_write(resume, keep_checkpoint=True)
+            file_helpers.append(file_helper)
 
-            self.__write_tsv(output_file_name + '.tsv', training_set)
-            self.__write_array(output_file_name + '_lookup' '.txt', dialog_lookup_table)
+        # Until now, the checkpoints of the complete training sets let a resumed build skip them
+        for file_helper in file_helpers:
+            JSON2Training.remove_checkpoint(file_helper)
@@ -1,5 +1,5 @@
 import json
-import csv
+from csearch.converters.json2training import JSON2Training
 from csearch.converters.json2training import WebJson2EasyTraining
 from csearch.converters.json2training import WebJson2Training
 from csearch.helpers.web_dataset_helper import WebDatasetHelper
@@ -7,30 +7,24 @@ from csearch.helpers.file_helper import FileHelper
 
 
 class WebTrainingSetBuilder:
-    def __init__(self, json_location):
+    def __init__(self, json_location, num_workers: int = 1, count_duplicates: bool = False, compression: str = None,
+                 output_format: str = 'tsv'):
+        """
+        :param json_location:
+        :param num_workers: Number of processes used to build the BM25 index and to generate the training sets
+        :param count_duplicates: Compute the BM25 statistics over the corpus with its duplicate documents, as before
+        the corpus was deduplicated (see DatasetHelper.build_corpus_bm25_helper)
+        :param compression: Compression of the training sets (see FileHelper)
+        :param output_format: Format of the training sets, tsv or binary (see JSON2Training.OUTPUT_FORMATS)
+        """
         self.__json_location: str = json_location
+        self.__num_workers: int = num_workers
+        self.__count_duplicates: bool = count_duplicates
+        self.__compression: str = compression
+        self.__output_format: str = output_format
         self.__json_data_prefix: str = 'merged_'
         self.__url_mapping_prefix: str = 'url_mapping_'
 
-    def __write_tsv(self, file_name: str, data: list, append: bool = False) -> None:
-        """
-        Given a filename and a list, this function writes the list in tsv format
-        :param file_name:
-        :param data:
-        :return:
-        """
-        write_mode = 'a' if append else 'w'
-        with open(self.__json_location + '/' + file_name, write_mode) as tsv_file:
-            writer = csv.writer(tsv_file, delimiter='\t', lineterminator='\n')
-            for entry in data:
-                writer.writerow(entry)
-
-    def __write_array(self, file_name: str, data: list, append: bool = False) -> None:
-        write_mode = 'a' if append else 'w'
-        with open(self.__json_location + '/' + file_name, write_mode) as f:
-            for entry in data:
-                f.write('%s\n' % entry)
-
     def __build_bm25_helper(self, is_easy=False):
         allocations = ['train', 'dev']
         json_data_for_bm25 = {}
@@ -49,20 +43,38 @@ class WebTrainingSetBuilder:
 
             url_mapping = {**url_mapping, **url_mapping_allocation}
 
+        # The index only depends on the input files, so the easy and hard builds share it
+        input_files = [
+            self.__json_location + prefix + allocation + suffix
+            for allocation in allocations
+            for prefix, suffix in [(self.__json_data_prefix, '_urls.json'), (self.__url_mapping_prefix, '.json')]
+        ]
+        index_folder = self.__json_location + 'bm25_index/web_' + FileHelper.get_files_hash(input_files)
+
         dataset_helper = WebDatasetHelper(url_mapping)
 
-        return dataset_helper.build_multi_topic_bm25_helper(json_data_for_bm25) if is_easy else \
-            dataset_helper.build_bm25_helper(json_data_for_bm25)
+        if is_easy:
+            return dataset_helper.build_multi_topic_bm25_helper(
+                json_data_for_bm25, index_folder, self.__num_workers, self.__count_duplicates
+            )
 
-    def build(self, is_easy=False) -> None:
+        return dataset_helper.build_bm25_helper(
+            json_data_for_bm25, index_folder, self.__num_workers, self.__count_duplicates
+        )
+
+    def build(self, is_easy=False, resume: bool = False) -> None:
         """
         Given a json structure, this function builds a tsv containing all possible (label, context, document) triples
         that can be obtained from the dialogues
+        :param is_easy:
+        :param resume: Continue an interrupted build from its last checkpoints (see JSON2Training.convert_and_write).
+        The training sets completed by the interrupted build are not converted again
         :return:
         """
         allocations = ['train', 'dev', 'test']
 
         bm25_helper = self.__build_bm25_helper(is_easy)
+        file_helpers = []
 
         for allocation in allocations:
             with open(self.__json_location + self.__json_data_prefix + allocation + '_urls.json', 'r') as f:
@@ -73,12 +85,22 @@ class WebTrainingSetBuilder:
 
             suffix = '' if is_easy else '_hard'
             file_location = self.__json_location + '/' + 'data_' + allocation + '_web' + suffix
-            file_helper = FileHelper(file_location)
+            file_helper = FileHelper(file_location, self.__compression)
 
-            json2training_converter = WebJson2EasyTraining(json_data, url_mapping_allocation, bm25_helper, file_helper) \
-                if is_easy else WebJson2Training(json_data, url_mapping_allocation, bm25_helper, file_helper)
+            json2training_converter = WebJson2EasyTraining(
+                json_data, url_mapping_allocation, bm25_helper, file_helper, self.__num_workers,
+                self.__output_format
+            ) if is_easy else WebJson2Training(
+                json_data, url_mapping_allocation, bm25_helper, file_helper, self.__num_workers,
+                self.__output_format
+            )
 
             del json_data
             del url_mapping_allocation
 
-            json2training_converter.convert_and_write()
+            json2training_converter.convert_and_write(resume, keep_checkpoint=True)
+            file_helpers.append(file_helper)
+
+        # Until now, the checkpoints of the complete training sets let a resumed build skip them
+        for file_helper in file_helpers:
+            JSON2Training.remove_checkpoint(file_helper)
@@ -1,3 +1,5 @@
 from csearch.converters.xml2pandas import XML2Pandas
 from csearch.converters.pandas2json import Pandas2JSON
 from csearch.converters.json2training import JSON2Training
+from csearch.converters.sentiment_scorer import SentimentScorer
+from csearch.converters.dialogue_filter import DialogueFilterPipeline
@@ -0,0 +1,127 @@
+from time import perf_counter
+from csearch.models.json_dialogue import JsonDialogue
+
+
+class DialogueFilterPipeline:
+    """
+    Decides which candidate dialogues make it into the dataset. The filters run in the configured order over all the
+    candidates of a question, and each filter only sees the candidates accepted by the previous ones. By default, the
+    cheap structural checks run first, so most candidates are rejected before any regex or sentiment scoring.
+    The number of candidates rejected by each filter and the time spent in it are recorded.
+    """
+    # Name -> (check returning True if the dialogue is kept, whether it needs the consecutive comments concatenated)
+    FILTERS = {
+        'two_way': (JsonDialogue.is_two_way, False),
+        'multiturn': (JsonDialogue.is_multiturn, True),
+        'not_deprecated': (lambda dialogue: not dialogue.is_deprecated(), True),
+        'grounded': (JsonDialogue.is_grounded, True),
+        'feedback_final_response': (JsonDialogue.is_feedback_final_response, True),
+    }
+
+    DEFAULT_ORDER = ['two_way', 'multiturn', 'not_deprecated', 'grounded', 'feedback_final_response']
+
+    def __init__(self, sentiment_scorer, filters: list = None):
+        """
+        :param sentiment_scorer: The SentimentScorer shared by the dialogues
+        :param filters: Names of the filters to apply, in order. Defaults to DEFAULT_ORDER
+        """
+        self.filters = list(DialogueFilterPipeline.DEFAULT_ORDER if filters is None else filters)
+
+        unknown_filters = set(self.filters) - set(DialogueFilterPipeline.FILTERS.keys())
+        if unknown_filters:
+            raise ValueError('Unknown dialogue filters: ' + ', '.join(sorted(unknown_filters)))
+
+        self.__sentiment_scorer = sentiment_scorer
+        self.candidates = 0
+        self.accepted = 0
+        self.rejections = {name: 0 for name in self.filters}
+        self.filter_time = {name: 0.0 for name in self.filters + ['concatenation']}
+
+    def __concatenate(self, dialogues: list) -> None:
+        start = perf_counter()
+        for dialogue in dialogues:
+            dialogue.concat_consecutive_same_person_comments()
+        self.filter_time['concatenation'] += perf_counter() - start
+
+    def __score_final_utterances(self, dialogues: list) -> list:
+        """
+        Scores all the final user utterances at once. The candidates of a question often end with the same comment
+        :param dialogues:
+        :return: The polarity of the final utterance of each dialogue, or None if it is not a user utterance
+        """
+        scores = iter(self.__sentiment_scorer.score_batch([
+            dialogue.utterances[-1].utterance for dialogue in dialogues
+            if dialogue.utterances[-1].actor_type == 'user'
+        ]))
+
+        return [next(scores) if dialogue.utterances[-1].actor_type == 'user' else None for dialogue in dialogues]
+
+    def apply(self, dialogues: list) -> list:
+        """
+        Runs the filters over the candidate dialogues of a question
+        :param dialogues: The candidate dialogues, in order
+        :return: The accepted dialogues, in the same order
+        """
+        dialogues = [dialogue for dialogue in dialogues if len(dialogue.utterances) > 0]
+        self.candidates += len(dialogues)
+        is_concatenated = False
+
+        for name in self.filters:
+            if not dialogues:
+                break
+
+            check, needs_concatenation = DialogueFilterPipeline.FILTERS[name]
+            if needs_concatenation and not is_concatenated:
+                self.__concatenate(dialogues)
+                is_concatenated = True
+
+            start = perf_counter()
+            if name == 'feedback_final_response':
+                # The batch scores are passed on, so that each final utterance is looked up in the cache only once
+                kept_dialogues = [
+                    dialogue for dialogue, polarity_score in zip(dialogues, self.__score_final_utterances(dialogues))
+                    if dialogue.is_feedback_final_response(polarity_score)
+                ]
+            else:
+                kept_dialogues = [dialogue for dialogue in dialogues if check(dialogue)]
+            self.filter_time[name] += perf_counter() - start
+
+            self.rejections[name] += len(dialogues) - len(kept_dialogues)
+            dialogues = kept_dialogues
+
+        # The dataset always contains the concatenated version of the dialogues
+        if not is_concatenated:
+            self.__concatenate(dialogues)
+
+        self.accepted += len(dialogues)
+
+        return dialogues
+
+    def get_stats(self) -> dict:
+        return {
+            'candidates': self.candidates,
+            'accepted': self.accepted,
+            'rejections': dict(self.rejections),
+            'filter_time': dict(self.filter_time),
+        }
+
+    def add_stats(self, stats: dict) -> None:
+        """
+        Adds the counters of another pipeline (e.g. one used by a worker process) to this one
+        :param stats: As returned by get_stats
+        :return:
+        """
+        self.candidates += stats['candidates']
+        self.accepted += stats['accepted']
+        for name, rejections in stats['rejections'].items():
+            self.rejections[name] += rejections
+        for name, filter_time in stats['filter_time'].items():
+            self.filter_time[name] += filter_time
+
+    def report(self) -> str:
+        lines = ['Dialogue filters: {} candidates, {} accepted'.format(self.candidates, self.accepted)]
+        for name in self.filters:
+            lines.append('    {}: {} rejected, {:.2f}s'.format(name, self.rejections[name], self.filter_time[name]))
+        lines.append('    concatenation: {:.2f}s'.format(self.filter_time['concatenation']))
+
+        return '\n'.join(lines)
@@ -1,22 +1,68 @@
 from csearch.helpers.bm25_helper import BM25Helper
 from csearch.helpers.file_helper import FileHelper
-from math import floor
+from csearch.helpers.pipeline_helper import PipelineHelper
+from csearch.helpers.shard_helper import ShardHelper
+from csearch.helpers.text_helper import TextHelper
+from csearch.helpers.training_set_store import TrainingSetWriter
+from contextlib import closing
+from multiprocessing import get_context
+import os
+import json
+import numpy as np
 from tqdm import tqdm
 
+# Version of the checkpoints written by JSON2Training. Checkpoints with another version are ignored
+CHECKPOINT_VERSION = 1
+
+
 class JSON2Training:
-    def __init__(self, json_data: dict, bm25_helper, file_helper: FileHelper):
+    # Number of dialogues whose negative sampling queries are scored together (see BM25Helper.prefetch_candidates)
+    PREFETCH_DIALOGUES = 1000
+    # Number of converted dialogues the sampling stage of the pipeline may be ahead of the writer (see
+    # __convert_range). A whole block, so that the writer keeps busy while the candidates of the next one are scored
+    PIPELINE_QUEUE_SIZE = 1000
+    # Number of dialogues between two checkpoints of a serial run (a multiple of PREFETCH_DIALOGUES)
+    CHECKPOINT_DIALOGUES = 10000
+    # Base seed of the negative sampling. Each context draws its samples with a generator of its own (see
+    # get_random_generator), so the samples do not depend on the order in which the dialogues are processed
+    RANDOM_SEED = 10
+    # Suffix of the checkpoint file, next to the output files
+    CHECKPOINT_SUFFIX = '_checkpoint.json'
+    # Suffixes of the files written in the tsv format
+    OUTPUT_SUFFIXES = ['.tsv', '_lookup.txt']
+    # tsv: one row per (context, candidate response) pair, and a lookup file with the dialogue of each row
+    # binary: one record per context, with its utterances and candidates stored once (see TrainingSetWriter)
+    OUTPUT_FORMATS = ['tsv', 'binary']
+    # Converter and dialogues of the worker processes of the parallel mode, inherited from the parent when it forks
+    __worker_state = None
+
+    def __init__(self, json_data: dict, bm25_helper, file_helper: FileHelper, num_workers: int = 1,
+                 output_format: str = 'tsv'):
+        """
+        :param json_data:
+        :param bm25_helper:
+        :param file_helper:
+        :param num_workers: Number of processes used to generate the training set. The workers share the BM25 index
+        of the parent process and the output is identical to the one of a serial run
+        :param output_format: One of OUTPUT_FORMATS. The binary training set can be expanded to the tsv files with
+        TrainingSetReader.write_tsv
+        """
+        if output_format not in JSON2Training.OUTPUT_FORMATS:
+            raise ValueError('Unknown training set format: ' + output_format)
+
         self.json_data = json_data
         self.bm25_helper = bm25_helper
-        self.training_set = []
-        self.dialog_lookup_table = []
         self.file_helper = file_helper
+        self.num_workers = num_workers
+        self.output_format = output_format
+        self.training_set_writer = None
 
-    def process_dialogue(self, key: str, dialogue: dict) -> None:
+    def process_dialogue(self, key: str, dialogue: dict):
         """
         Given an entire dialogue, this function creates all the possible context-response entries
         :param key:
         :param dialogue:
-        :return:
+        :return: Generator of (context utterances, true response, negative responses) tuples (see _add_context)
         """
         utterances = dialogue['utterances']
         user_utterances = list(
@@ -40,50 +86,455 @@ class JSON2Training:
 
             true_answer = training_entry[-1]
 
-            self.dialog_lookup_table.append(int(key))
-            self.training_set.append(training_entry)
+            top_responses = JSON2Training._get_negative_responses(
+                self.bm25_helper, true_answer, 51, JSON2Training.get_random_generator(key, current_pos)
+            )
+
+            yield (training_entry[1:len(training_entry) - 1], true_answer,
+                   [self.bm25_helper.get_document(top_response) for top_response in top_responses])
+
+    def _add_context(self, key: str, context: list, true_response: str, negative_responses: list) -> None:
+        """
+        Adds the entries of a context: a positive one with the true response, and a negative one per negative response
+        :param key:
+        :param context: The utterances of the context
+        :param true_response:
+        :param negative_responses:
+        :return:
+        """
+        if self.output_format == 'binary':
+            self.training_set_writer.write_context(int(key), context, true_response, negative_responses)
+            return
+
+        self.file_helper.write_rows('.tsv', [[1] + context + [true_response]])
+        self.file_helper.write_rows('.tsv', [
+            [0] + context + [negative_response] for negative_response in negative_responses
+        ])
+        self.file_helper.write_lines('_lookup.txt', [int(key)] * (1 + len(negative_responses)))
+
+    @classmethod
+    def get_random_generator(cls, key: str, position: int) -> np.random.Generator:
+        """
+        Returns the generator the negative samples of a context are drawn with. It only depends on RANDOM_SEED, the
+        dialogue and the position of the context in the dialogue, so the samples of a context are the same whatever
+        the number of workers or the dialogue the generation starts from
+        :param key: Key of the dialogue in the json dataset
+        :param position: Position of the last user utterance of the context
+        :return:
+        """
+        return np.random.default_rng([JSON2Training.RANDOM_SEED, int(key), position])
 
-            negative_training_entry = ([0] + training_entry[1:len(training_entry) - 1])
-            top_responses = self.bm25_helper.get_negative_samples(true_answer, 51)
+    @classmethod
+    def _get_negative_responses(cls, bm25_helper, true_answer: str, n: int,
+                                random_generator: np.random.Generator) -> list:
+        """
+        Samples n BM25 responses for a true answer, then drops the true answer if it was sampled (or the first sample
+        otherwise), leaving n - 1 negative responses
+        :param bm25_helper:
+        :param true_answer:
+        :param n:
+        :param random_generator: See get_random_generator
+        :return: Document IDs of the negative responses (see BM25Helper.get_document)
+        """
+        top_responses = bm25_helper.get_negative_samples(true_answer, n, random_generator)
+        true_answer_id = bm25_helper.get_document_index(true_answer)
 
-            index_to_delete = 0
-            if true_answer in top_responses:
-                index_to_delete = top_responses.index(true_answer)
+        index_to_delete = 0
+        if true_answer_id in top_responses:
+            index_to_delete = top_responses.index(true_answer_id)
 
+        if top_responses:
             del(top_responses[index_to_delete])
 
-            for top_response in top_responses:
-                self.dialog_lookup_table.append(int(key))
-                self.training_set.append(negative_training_entry + [top_response])
+        return top_responses
+
+    @classmethod
+    def _get_response_positions(cls, dialogue: dict) -> list:
+        """
+        Returns the positions of the user utterances for which process_dialogue builds a context, i.e. every user
+        utterance but the first one that is followed by an agent response
+        :param dialogue:
+        :return:
+        """
+        utterances = dialogue['utterances']
+        user_positions = [utterance['utterance_pos'] for utterance in utterances if utterance['actor_type'] == 'user']
+
+        return [position for position in user_positions[1:] if position < len(utterances)]
+
+    def get_bm25_queries(self, dialogue: dict) -> list:
+        """
+        Returns the (BM25 helper, query) pairs for which process_dialogue will draw negative samples
+        :param dialogue:
+        :return:
+        """
+        utterances = dialogue['utterances']
+
+        return [(self.bm25_helper, utterances[position]['utterance'])
+                for position in JSON2Training._get_response_positions(dialogue)]
 
-    def get_dialog_lookup_table(self) -> list:
-        return self.dialog_lookup_table
+    def prefetch_candidates(self, dialogues: list) -> None:
+        """
+        Computes the negative sampling candidates of all the given dialogues with one batch per BM25 helper
+        :param dialogues:
+        :return:
+        """
+        helper_queries = {}
+        for dialogue in dialogues:
+            for bm25_helper, query in self.get_bm25_queries(dialogue):
+                helper_queries.setdefault(id(bm25_helper), (bm25_helper, []))[1].append(query)
 
-    def write_and_clear_training(self):
-        self.file_helper.write_tsv('.tsv', self.training_set, append=True)
-        self.training_set = []
-        self.file_helper.write_array('_lookup.txt', self.dialog_lookup_table, append=True)
-        self.dialog_lookup_table = []
+        for bm25_helper, queries in helper_queries.values():
+            bm25_helper.prefetch_candidates(queries)
 
-    def convert_and_write(self) -> None:
+    def convert_and_write(self, resume: bool = False, keep_checkpoint: bool = False) -> None:
         """
-        Converts all the dialogues contained in a json structure into a list of (label, context, response) triples
+        Converts all the dialogues contained in a json structure into a list of (label, context, response) triples.
+        A checkpoint is recorded every CHECKPOINT_DIALOGUES dialogues (and at the end), so that an interrupted run can
+        be resumed. It is deleted once the output files are complete
+        :param resume: Continue from the checkpoint of a previous run, if there is one for the same dataset and
+        settings. The files are truncated to the checkpoint, so the output is the same as the one of an uninterrupted
+        run. Otherwise, the output files are written anew
+        :param keep_checkpoint: Once the output files are complete, replace the checkpoint with one recording their
+        final size instead of deleting it. Resuming then skips the conversion as long as the files are unchanged. Used
+        by the builders, which write several training sets in a row and delete the checkpoints once all of them are
+        complete (see remove_checkpoint)
         :return:
         """
         dataset_size = len(self.json_data.keys())
-        progress_increment = floor(dataset_size / 100)
+        dataset_items = list(self.json_data.items())
+
+        checkpoint = self.__read_checkpoint(dataset_size) if resume else None
+        if checkpoint is not None and checkpoint.get('complete'):
+            print('The training set is already complete')
+            if not keep_checkpoint:
+                JSON2Training.remove_checkpoint(self.file_helper)
+            return
+
+        start = 0 if checkpoint is None else checkpoint['dialogues']
+
+        if start > 0:
+            print('Resuming after dialogue ' + str(checkpoint['last_key']))
 
         print('Converting the json to training set')
-        with tqdm(total=len(self.json_data)) as pbar:
-            for (key, dialogue) in self.json_data.items():
-                if len(self.json_data) < 30000 or int(key) > 40459:
-                    if int(key) % progress_increment == 0:
-                        self.write_and_clear_training()
+        shard_ranges = self.__get_shard_ranges(start, dataset_size)
+        self.__prepare_output(checkpoint)
+
+        try:
+            if self.num_workers > 1 and len(shard_ranges) > 1:
+                self.__convert_parallel(dataset_items, shard_ranges)
+            else:
+                self.__open_files()
+                with tqdm(total=dataset_size, initial=start) as pbar:
+                    self.__convert_range(dataset_items, start, dataset_size, pbar, write_checkpoints=True)
+        finally:
+            self.__close_output()
+
+        if keep_checkpoint:
+            self.__write_complete_checkpoint(dataset_size)
+        else:
+            JSON2Training.remove_checkpoint(self.file_helper)
+
+    def __get_checkpoint_file(self) -> str:
+        return self.file_helper.get_file_name(JSON2Training.CHECKPOINT_SUFFIX)
+
+    @classmethod
+    def remove_checkpoint(cls, file_helper: FileHelper) -> None:
+        """
+        Deletes the checkpoint of the training set written by file_helper, if there is one
+        :param file_helper:
+        :return:
+        """
+        checkpoint_file = file_helper.get_file_name(JSON2Training.CHECKPOINT_SUFFIX)
+        if os.path.isfile(checkpoint_file):
+            os.remove(checkpoint_file)
+
+    def __read_checkpoint(self, dataset_size: int):
+        """
+        Returns the checkpoint of a previous run, if it was written for the same dataset and settings
+        :param dataset_size:
+        :return:
+        """
+        try:
+            with open(self.__get_checkpoint_file(), 'r') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        expected_settings = self.__get_checkpoint_settings(dataset_size)
+        if any(checkpoint.get(name) != value for name, value in expected_settings.items()):
+            print('The checkpoint does not match the training set, starting over')
+            return None
+
+        # The complete output files must not have changed since they were written
+        if checkpoint.get('complete'):
+            if not all(os.path.isfile(file_name) and os.path.getsize(file_name) == size
+                       for file_name, size in checkpoint['sizes'].items()):
+                print('The output files changed since the training set was completed, starting over')
+                return None
+
+            return checkpoint
+
+        # The output files must hold everything written up to the checkpoint (they are only cut back to it)
+        if self.output_format == 'binary':
+            has_output = TrainingSetWriter.has_state(self.file_helper.get_file_name(''), checkpoint['store'])
+        else:
+            has_output = all(
+                self.file_helper.has_size(suffix, checkpoint['offsets'][suffix])
+                for suffix in JSON2Training.OUTPUT_SUFFIXES
+            )
+
+        if not has_output:
+            print('The output files are missing or shorter than at the checkpoint, starting over')
+            return None
+
+        return checkpoint
+
+    def __get_checkpoint_settings(self, dataset_size: int) -> dict:
+        return {
+            'version': CHECKPOINT_VERSION,
+            'dataset_size': dataset_size,
+            'output_format': self.output_format,
+            'compression': self.file_helper.compression,
+            # The negative samples of each context only depend on the seed (see get_random_generator), so the seed is
+            # the whole state of the random generators
+            'random_seed': JSON2Training.RANDOM_SEED,
+        }
+
+    def __write_checkpoint(self, dataset_items: list, dialogues: int, reopen_files: bool) -> None:
+        """
+        Records the position reached, together with the size of the output files. The output files are written to the
+        disk (fsync) before the checkpoint, which is then replaced atomically: after a crash, the checkpoint is the
+        previous one or the new one, and the files hold at least what it records
+        :param dataset_items:
+        :param dialogues: Number of dialogues whose entries are all written
+        :param reopen_files: Open the tsv files again, in order to keep writing
+        :return:
+        """
+        checkpoint = self.__get_checkpoint_settings(len(dataset_items))
+        checkpoint['dialogues'] = dialogues
+        checkpoint['last_key'] = dataset_items[dialogues - 1][0] if dialogues > 0 else None
+
+        if self.output_format == 'binary':
+            self.training_set_writer.sync()
+            checkpoint['store'] = self.training_set_writer.get_state()
+        else:
+            # Closing the files also ends their compressed stream, so that they can be truncated at this point
+            self.file_helper.close()
+            checkpoint['offsets'] = {}
+            for suffix in JSON2Training.OUTPUT_SUFFIXES:
+                self.file_helper.sync(suffix)
+                checkpoint['offsets'][suffix] = self.file_helper.get_size(suffix)
+
+            if reopen_files:
+                self.__open_files()
+
+        self.__save_checkpoint(checkpoint)
+
+    def __write_complete_checkpoint(self, dataset_size: int) -> None:
+        """
+        Records that the output files are complete, together with their final size. The files are written to the disk
+        (fsync) before the checkpoint
+        :param dataset_size:
+        :return:
+        """
+        if self.output_format == 'binary':
+            file_names = [self.file_helper.get_file_name(suffix)
+                          for suffix in TrainingSetWriter.FILE_SUFFIXES + [TrainingSetWriter.METADATA_SUFFIX]]
+        else:
+            file_names = [self.file_helper.get_output_name(suffix) for suffix in JSON2Training.OUTPUT_SUFFIXES]
+
+        checkpoint = self.__get_checkpoint_settings(dataset_size)
+        checkpoint['dialogues'] = dataset_size
+        checkpoint['complete'] = True
+        checkpoint['sizes'] = {}
+        for file_name in file_names:
+            with open(file_name, 'ab') as f:
+                os.fsync(f.fileno())
+            checkpoint['sizes'][file_name] = os.path.getsize(file_name)
+
+        self.__save_checkpoint(checkpoint)
+
+    def __save_checkpoint(self, checkpoint: dict) -> None:
+        # Written atomically: a checkpoint is either the previous one or the new one
+        checkpoint_file = self.__get_checkpoint_file()
+        with open(checkpoint_file + '.tmp', 'w') as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(checkpoint_file + '.tmp', checkpoint_file)
+
+    def __prepare_output(self, checkpoint: dict = None) -> None:
+        """
+        Empties the output files, or truncates them to a checkpoint. The binary writer is kept open until
+        __close_output
+        :param checkpoint:
+        :return:
+        """
+        if checkpoint is None:
+            JSON2Training.remove_checkpoint(self.file_helper)
+
+        if self.output_format == 'binary':
+            self.training_set_writer = TrainingSetWriter(
+                self.file_helper.get_file_name(''), None if checkpoint is None else checkpoint['store']
+            )
+            return
+
+        for suffix in JSON2Training.OUTPUT_SUFFIXES:
+            if checkpoint is None:
+                self.file_helper.clear(suffix)
+            else:
+                self.file_helper.truncate(suffix, checkpoint['offsets'][suffix])
+
+    def __open_files(self) -> None:
+        """
+        Opens the tsv files, which stay open (and buffered by the file helper) until __close_output
+        :return:
+        """
+        if self.output_format == 'binary':
+            return
+
+        for suffix in JSON2Training.OUTPUT_SUFFIXES:
+            self.file_helper.open(suffix, append=True)
+
+    def __close_output(self) -> None:
+        self.file_helper.close()
+
+        if self.training_set_writer is not None:
+            self.training_set_writer.close()
+            self.training_set_writer = None
+
+    @classmethod
+    def __iter_blocks(cls, dataset_items: list, start: int, end: int):
+        """
+        First stage of the conversion pipeline: the dialogues of the slice start:end, in blocks of PREFETCH_DIALOGUES
+        :param dataset_items:
+        :param start:
+        :param end:
+        :return: Generator of lists of (key, dialogue) pairs
+        """
+        for block_start in range(start, end, JSON2Training.PREFETCH_DIALOGUES):
+            yield dataset_items[block_start:min(end, block_start + JSON2Training.PREFETCH_DIALOGUES)]
+
+    def __iter_contexts(self, blocks):
+        """
+        Second stage of the conversion pipeline: the candidates of the negative sampling of each block are scored in a
+        single batch, then the contexts of its dialogues are built and their negative samples drawn
+        :param blocks: See __iter_blocks
+        :return: Generator of (key, contexts) pairs, one per dialogue, in order (see process_dialogue)
+        """
+        for block in blocks:
+            self.prefetch_candidates([dialogue for (key, dialogue) in block])
+
+            for (key, dialogue) in block:
+                yield key, list(self.process_dialogue(key, dialogue))
+
+    def __convert_range(self, dataset_items: list, start: int, end: int, pbar: tqdm = None,
+                        write_checkpoints: bool = False) -> None:
+        """
+        Converts the dialogues in the slice start:end of the dataset and writes their entries. The conversion is a
+        pipeline of generators (__iter_blocks, then __iter_contexts) whose contexts are written here. The sampling runs
+        in a thread of its own, at most PIPELINE_QUEUE_SIZE dialogues ahead of the writer, so that the negative sampling
+        and the writing (and compression) of the entries overlap, in constant memory
+        :param dataset_items: All the (key, dialogue) pairs of the dataset, in order
+        :param start:
+        :param end:
+        :param pbar:
+        :param write_checkpoints: Write a checkpoint every CHECKPOINT_DIALOGUES dialogues of the dataset, and at the end
+        :return:
+        """
+        dialogues = PipelineHelper.buffer(
+            self.__iter_contexts(JSON2Training.__iter_blocks(dataset_items, start, end)),
+            JSON2Training.PIPELINE_QUEUE_SIZE
+        )
+
+        with closing(dialogues):
+            for position, (key, contexts) in enumerate(dialogues, start + 1):
+                for context, true_response, negative_responses in contexts:
+                    self._add_context(key, context, true_response, negative_responses)
+
+                if (position - start) % JSON2Training.PREFETCH_DIALOGUES != 0 and position != end:
+                    continue
+
+                # Keeps the memory of the binary writer bounded (the file helper writes its buffers by itself)
+                if self.training_set_writer is not None:
+                    self.training_set_writer.flush()
+
+                if write_checkpoints and (position % JSON2Training.CHECKPOINT_DIALOGUES == 0 or position == end):
+                    self.__write_checkpoint(dataset_items, position, reopen_files=position < end)
+
+                if pbar is not None:
+                    pbar.update((position - start - 1) % JSON2Training.PREFETCH_DIALOGUES + 1)
+
+    def __get_shard_ranges(self, start: int, end: int) -> list:
+        """
+        Splits the dialogues start to end in contiguous (start, end) ranges made of whole blocks of PREFETCH_DIALOGUES
+        dialogues
+        :param start:
+        :param end:
+        :return:
+        """
+        return ShardHelper.get_shard_ranges(start, end, self.num_workers, JSON2Training.PREFETCH_DIALOGUES)
+
+    @classmethod
+    def convert_shard(cls, shard: tuple) -> int:
+        """
+        Worker entry point of the parallel mode. Converts a range of dialogues with the converter inherited from the
+        parent process, and writes the entries to the files of the shard
+        :param shard: Tuple (start, end, FileHelper of the shard)
+        :return: The number of dialogues of the shard
+        """
+        start, end, file_helper = shard
+        converter, dataset_items = JSON2Training.__worker_state
 
-                    self.process_dialogue(key, dialogue)
-                pbar.update(1)
+        converter.file_helper = file_helper
+        converter.__prepare_output()
+        converter.__open_files()
+        converter.__convert_range(dataset_items, start, end)
+        converter.__close_output()
 
-        self.write_and_clear_training()
+        return end - start
+
+    def __convert_parallel(self, dataset_items: list, shard_ranges: list) -> None:
+        """
+        Converts the dialogues across a pool of forked processes, which share the BM25 index and the dialogues of this
+        one. Each shard is written to files of its own, which are appended to the output files in their original
+        order, so the output is the same as the one of a serial run. A checkpoint is written after each shard
+        :param dataset_items:
+        :param shard_ranges:
+        :return:
+        """
+        print('Converting with ' + str(self.num_workers) + ' workers')
+        shards = [
+            (start, end, self.file_helper.get_shard_helper(shard_index))
+            for shard_index, (start, end) in enumerate(shard_ranges)
+        ]
+
+        # Forked workers inherit the state instead of receiving a (pickled) copy of the index and the dialogues
+        JSON2Training.__worker_state = (self, dataset_items)
+        try:
+            with get_context('fork').Pool(processes=self.num_workers) as pool, \
+                    tqdm(total=len(dataset_items), initial=shard_ranges[0][0]) as pbar:
+                for shard, shard_size in zip(shards, pool.imap(JSON2Training.convert_shard, shards)):
+                    if self.output_format == 'binary':
+                        self.training_set_writer.append_file(shard[2].get_file_name(''))
+                    else:
+                        for suffix in JSON2Training.OUTPUT_SUFFIXES:
+                            self.file_helper.append_file(suffix, shard[2])
+
+                    self.__write_checkpoint(dataset_items, shard[1], reopen_files=False)
+                    pbar.update(shard_size)
+        finally:
+            JSON2Training.__worker_state = None
+
+            # The shards not appended yet (when a worker fails) are converted again when resuming
+            for shard in shards:
+                if self.output_format == 'binary':
+                    for suffix in TrainingSetWriter.FILE_SUFFIXES + [TrainingSetWriter.METADATA_SUFFIX]:
+                        if os.path.isfile(shard[2].get_file_name(suffix)):
+                            os.remove(shard[2].get_file_name(suffix))
+                else:
+                    for suffix in JSON2Training.OUTPUT_SUFFIXES:
+                        shard[2].remove(suffix)
 
 
 class Json2EasyTraining(JSON2Training):
@@ -91,10 +542,18 @@ class Json2EasyTraining(JSON2Training):
     Class to help build the "easy" training task, which creates 10 negative samples for each query, taking
     samples only from the same domain as the original query
     """
-    def __init__(self, json_data: dict, bm_25_helper):
-        super().__init__(json_data, bm_25_helper)
+    def __init__(self, json_data: dict, bm_25_helper, file_helper: FileHelper, num_workers: int = 1,
+                 output_format: str = 'tsv'):
+        super().__init__(json_data, bm_25_helper, file_helper, num_workers, output_format)
         self.bm25_helper = bm_25_helper
 
+    def get_bm25_queries(self, dialogue: dict) -> list:
+        utterances = dialogue['utterances']
+        bm25_helper = self.bm25_helper[dialogue['category']]
+
+        return [(bm25_helper, utterances[position]['utterance'])
+                for position in JSON2Training._get_response_positions(dialogue)]
+
     def process_dialogue(self, key: str, dialogue: dict):
         utterances = dialogue['utterances']
         topic = dialogue['category']
@@ -118,35 +577,39 @@ class Json2EasyTraining(JSON2Training):
                                      if first_utterance_pos <= utterance['utterance_pos'] <= current_pos + 1])
             true_answer = training_entry[-1]
 
-            self.dialog_lookup_table.append(int(key))
-            self.training_set.append(training_entry)
-
-            negative_training_entry = ([0] + training_entry[1:len(training_entry) - 1])
-            top_responses = self.bm25_helper[topic].get_negative_samples(true_answer, 11)
-
-            index_to_delete = 0
-            if true_answer in top_responses:
-                index_to_delete = top_responses.index(true_answer)
-
-            del (top_responses[index_to_delete])
+            top_responses = JSON2Training._get_negative_responses(
+                self.bm25_helper[topic], true_answer, 11, JSON2Training.get_random_generator(key, current_pos)
+            )
 
-            for top_response in top_responses:
-                self.dialog_lookup_table.append(int(key))
-                self.training_set.append(negative_training_entry + [top_response])
+            yield (training_entry[1:len(training_entry) - 1], true_answer,
+                   [self.bm25_helper[topic].get_document(top_response) for top_response in top_responses])
 
 
 class WebJson2Training(JSON2Training):
-    def __init__(self, json_data: dict, url_mapping: dict, bm_25_helper, file_helper):
-        super().__init__(json_data, bm_25_helper, file_helper)
+    def __init__(self, json_data: dict, url_mapping: dict, bm_25_helper, file_helper, num_workers: int = 1,
+                 output_format: str = 'tsv'):
+        super().__init__(json_data, bm_25_helper, file_helper, num_workers, output_format)
         self.bm25_helper = bm_25_helper
         self.url_mapping = url_mapping
 
-    def process_dialogue(self, key: str, dialogue: dict) -> None:
+    def get_bm25_queries(self, dialogue: dict) -> list:
+        utterances = dialogue['utterances']
+        bm25_helper = self.bm25_helper
+        queries = []
+
+        for position in JSON2Training._get_response_positions(dialogue):
+            queries += [(bm25_helper, TextHelper.flatten_document(self.url_mapping[url]['text']))
+                        for url in utterances[position]['urls'] if url in self.url_mapping]
+
+        return queries
+
+    def process_dialogue(self, key: str, dialogue: dict):
         """
-        Given an entire dialogue, this function creates all the possible context-response entries
+        Given an entire dialogue, this function creates all the possible context-document entries, one per document
+        cited by each agent response
         :param key:
         :param dialogue:
-        :return:
+        :return: Generator of (context utterances, true document, negative documents) tuples (see _add_context)
         """
         utterances = dialogue['utterances']
         user_utterances = list(
@@ -174,47 +637,66 @@ class WebJson2Training(JSON2Training):
             if not true_answer_urls:
                 continue
 
-            true_documents = [self.url_mapping[url]['text'].replace('\n', '.').replace('\r', '.') for url in true_answer_urls]
+            true_documents = [TextHelper.flatten_document(self.url_mapping[url]['text']) for url in true_answer_urls]
             negative_samples = []
+            random_generator = JSON2Training.get_random_generator(key, current_pos)
 
             for true_document in true_documents:
-                negative_samples += self.process_url(training_entry, true_documents, negative_samples, key, true_document)
+                top_responses = self.process_url(true_documents, negative_samples, true_document, random_generator)
+                negative_samples += top_responses
 
-    def process_url(self, training_entry: list, true_documents: list, negative_samples: list, key: str, true_document: str) -> list:
-        url_training_entry = training_entry + [true_document]
+                yield training_entry[1:], true_document, [
+                    self.bm25_helper.get_document(top_response) for top_response in top_responses
+                ]
 
-        self.dialog_lookup_table.append(int(key))
-        self.training_set.append(url_training_entry)
-
-        negative_training_entry = ([0] + training_entry[1:])
+    def process_url(self, true_documents: list, negative_samples: list, true_document: str,
+                    random_generator: np.random.Generator) -> list:
+        """
+        Samples the negative documents of a true document, leaving out the true documents of the context and the
+        negative documents already sampled for it
+        :param true_documents:
+        :param negative_samples:
+        :param true_document:
+        :param random_generator: See JSON2Training.get_random_generator
+        :return: Document IDs of the negative documents
+        """
         top_responses = self.bm25_helper.get_negative_samples(true_document, 50 + len(true_documents),
+                                                              random_generator,
                                                               existing_negative_samples=negative_samples)
 
+        true_document_ids = set(self.bm25_helper.get_document_index(document) for document in true_documents)
         top_responses_without_true_documents = list(
-            filter(lambda response: response not in true_documents, top_responses)
+            filter(lambda response: response not in true_document_ids, top_responses)
         )
 
-        top_responses_without_true_documents = top_responses_without_true_documents[0:50]
-
-        for top_response in top_responses_without_true_documents:
-            self.dialog_lookup_table.append(int(key))
-            self.training_set.append(negative_training_entry + [top_response])
-
-        return top_responses_without_true_documents
+        return top_responses_without_true_documents[0:50]
 
 
 class WebJson2EasyTraining(JSON2Training):
-    def __init__(self, json_data: dict, url_mapping:dict, bm_25_helper, file_helper):
-        super().__init__(json_data, bm_25_helper, file_helper)
+    def __init__(self, json_data: dict, url_mapping:dict, bm_25_helper, file_helper, num_workers: int = 1,
+                 output_format: str = 'tsv'):
+        super().__init__(json_data, bm_25_helper, file_helper, num_workers, output_format)
         self.bm25_helper = bm_25_helper
         self.url_mapping = url_mapping
 
-    def process_dialogue(self, key: str, dialogue: dict) -> None:
+    def get_bm25_queries(self, dialogue: dict) -> list:
+        utterances = dialogue['utterances']
+        bm25_helper = self.bm25_helper[dialogue['category']]
+        queries = []
+
+        for position in JSON2Training._get_response_positions(dialogue):
+            queries += [(bm25_helper, TextHelper.flatten_document(self.url_mapping[url]['text']))
+                        for url in utterances[position]['urls'] if url in self.url_mapping]
+
+        return queries
+
+    def process_dialogue(self, key: str, dialogue: dict):
         """
-        Given an entire dialogue, this function creates all the possible context-response entries
+        Given an entire dialogue, this function creates all the possible context-document entries, one per document
+        cited by each agent response
         :param key:
         :param dialogue:
-        :return:
+        :return: Generator of (context utterances, true document, negative documents) tuples (see _add_context)
         """
         utterances = dialogue['utterances']
         topic = dialogue['category']
@@ -243,26 +725,32 @@ class WebJson2EasyTraining(JSON2Training):
             if not true_answer_urls:
                 continue
 
-            true_documents = [self.url_mapping[url]['text'].replace('\n', '.').replace('\r', '.') for url in true_answer_urls]
+            true_documents = [TextHelper.flatten_document(self.url_mapping[url]['text']) for url in true_answer_urls]
+            random_generator = JSON2Training.get_random_generator(key, current_pos)
 
             for true_document in true_documents:
-                self.process_url(training_entry, true_documents, topic, key, true_document)
+                top_responses = self.process_url(true_documents, topic, true_document, random_generator)
 
-    def process_url(self, training_entry: list, true_documents: list, topic: str, key: str, true_document: str) -> None:
-        url_training_entry = training_entry + [true_document]
+                yield training_entry[1:], true_document, [
+                    self.bm25_helper[topic].get_document(top_response) for top_response in top_responses
+                ]
 
-        self.dialog_lookup_table.append(int(key))
-        self.training_set.append(url_training_entry)
-
-        negative_training_entry = ([0] + training_entry[1:])
-        top_responses = self.bm25_helper[topic].get_negative_samples(true_document, 10 + len(true_documents))
+    def process_url(self, true_documents: list, topic: str, true_document: str,
+                    random_generator: np.random.Generator) -> list:
+        """
+        Samples the negative documents of a true document from its topic, leaving out the true documents of the context
+        :param true_documents:
+        :param topic:
+        :param true_document:
+        :param random_generator: See JSON2Training.get_random_generator
+        :return: Document IDs of the negative documents
+        """
+        bm25_helper = self.bm25_helper[topic]
+        top_responses = bm25_helper.get_negative_samples(true_document, 10 + len(true_documents), random_generator)
 
+        true_document_ids = set(bm25_helper.get_document_index(document) for document in true_documents)
         top_responses_without_true_documents = list(
-            filter(lambda response: response not in true_documents, top_responses)
+            filter(lambda response: response not in true_document_ids, top_responses)
         )
 
-        top_responses_without_true_documents = top_responses_without_true_documents[0:10]
-
-        for top_response in top_responses_without_true_documents:
-            self.dialog_lookup_table.append(int(key))
-            self.training_set.append(negative_training_entry + [top_response])
+        return top_responses_without_true_documents[0:10]
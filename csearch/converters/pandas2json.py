@@ -1,103 +1,137 @@
 from math import floor
+from multiprocessing import Pool
+from tqdm import tqdm
+import numpy as np
+import pandas as pd
 from pandas import DataFrame
 from csearch.models.json_dialogue import JsonDialogue
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
+from csearch.converters.sentiment_scorer import SentimentScorer
+from csearch.converters.dialogue_filter import DialogueFilterPipeline
+from csearch.helpers.shard_helper import ShardHelper
 
 
 class Pandas2JSON:
     """
     This class handles the conversion of a Pandas dataframe to a JSON dataset
     """
-
-    def __init__(self, df: DataFrame, topic: str):
+    def __init__(self, df: DataFrame, topic: str, num_workers: int = 1, filters: list = None):
+        """
+        :param df: The merged dump DataFrame
+        :param topic:
+        :param num_workers: Number of processes used to generate the dialogues
+        :param filters: Names of the dialogue filters to apply, in order (see DialogueFilterPipeline)
+        """
         self.df = df
         self.topic = topic
-        self.__output = {}
-        self.__global_index = 0
-        self.sid = SentimentIntensityAnalyzer()
+        self.num_workers = num_workers
+        self.__accepted_entries = []
+        self.sentiment_scorer = SentimentScorer()
+        self.filter_pipeline = DialogueFilterPipeline(self.sentiment_scorer, filters)
 
-    def __init_entry(self, utterance: dict, usernames: tuple) -> JsonDialogue:
+    def __init_entry(self, original_post: tuple, usernames: tuple) -> JsonDialogue:
         """
         Format the standard entry before adding the utterances
-        :param utterance:
+        :param original_post: The question record
         :return: An dialogue "stub"
         """
-        return JsonDialogue(self.topic, utterance['Title'], utterance['CreationDate_post'], usernames, self.sid)
-
-    def __add_to_output(self, entry: JsonDialogue) -> None:
-        if len(entry.utterances) == 0:
-            return
-
-        entry.concat_consecutive_same_person_comments()
-
-        if not entry.is_grounded():
-            return
-
-        if not entry.is_multiturn():
-            return
-
-        if not entry.is_feedback_final_response():
-            return
-
-        if not entry.is_two_way():
-            return
+        return JsonDialogue.from_question(self.topic, original_post, usernames, self.sentiment_scorer)
 
-        if entry.is_deprecated():
-            return
-
-        self.__output[self.__global_index] = entry.as_dict()
-        self.__global_index += 1
+    def __add_to_output(self, entries: list) -> None:
+        """
+        Filters the candidate dialogues of a question and queues the valid ones for output
+        :param entries: The candidate dialogues, in order
+        :return:
+        """
+        for entry in self.filter_pipeline.apply(entries):
+            # The dialogues are kept in their compact form. They only become dictionaries when written
+            entry.release_filter_state()
+            self.__accepted_entries.append(entry)
 
     @classmethod
-    def __get_usernames(cls, df: DataFrame) -> list:
-        users_comments = df.loc[~df['DisplayName_comment'].isnull()].drop_duplicates('DisplayName_comment')[
-            'DisplayName_comment'].tolist()
-        users_posts = df.drop_duplicates('DisplayName_post')['DisplayName_post'].tolist()
+    def __get_usernames(cls, responses: list) -> set:
+        users_comments = set(
+            response.DisplayName_comment for response in responses if isinstance(response.DisplayName_comment, str)
+        )
+        users_posts = set(response.DisplayName_post for response in responses)
 
-        return users_comments + list(set(users_posts) - set(users_comments))
+        return users_comments | users_posts
 
-    def __generate_dialogues_from_responses(self, original_post, responses) -> None:
+    def __generate_dialogues_from_responses(self, original_post: tuple, responses: list) -> None:
         """
         Given a question, this function processes all the responses and turns them into separate dialogues
-        :param original_post: The original question on the thread
-        :param responses: A list of all the responses
+        :param original_post: The original question on the thread (record with the DataFrame columns as fields)
+        :param responses: A list of all the response records
         :return:
         """
-        if responses.shape[0] == 0:
+        if len(responses) == 0:
             return
 
-        user_username = original_post['DisplayName_post']
-        usernames = tuple(set(self.__get_usernames(responses)) - set(user_username))
+        user_username = original_post.DisplayName_post
+        usernames = tuple(self.__get_usernames(responses) - set(user_username))
         # current_agent_usernames = []
 
-        current_post_id = responses.iloc[0]['Id_post']
-        accepted_answer_id = original_post['AcceptedAnswerId']
-        original_user_id = original_post['OwnerUserId']
+        current_post_id = responses[0].Id_post
+        accepted_answer_id = original_post.AcceptedAnswerId
+        original_user_id = original_post.OwnerUserId
 
+        entries = []
         entry = self.__init_entry(original_post, usernames)
-        for index, response in responses.iterrows():
-            if response['OwnerUserId'] == original_user_id:
+        for response in responses:
+            if response.OwnerUserId == original_user_id:
                 continue
 
-            current_response_id = response['Id_post']
+            current_response_id = response.Id_post
             is_accepted = (current_response_id == accepted_answer_id)
 
             if current_response_id == current_post_id:
                 entry.append_utterance(original_post, response, is_accepted)
             else:
-                self.__add_to_output(entry)
+                entries.append(entry)
 
                 entry = self.__init_entry(original_post, usernames)
                 entry.append_utterance(original_post, response, is_accepted)
 
                 current_post_id = current_response_id
 
-        self.__add_to_output(entry)
+        entries.append(entry)
+        self.__add_to_output(entries)
+
+    @classmethod
+    def __group_responses(cls, original_posts_df: DataFrame, responses_df: DataFrame) -> tuple:
+        """
+        Groups the responses by the question they belong to. The responses are reordered by the position of their
+        question in original_posts_df (keeping their relative order), so that the responses of the i-th question
+        are the contiguous slice offsets[i]:offsets[i + 1]
+        :param original_posts_df: The questions, in the order in which they are processed
+        :param responses_df: All the responses (answers and their comments)
+        :return: The grouped responses and the offsets (one more than the number of questions)
+        """
+        question_positions = pd.Index(original_posts_df['Id_post']).get_indexer(responses_df['ParentId'])
+
+        # Responses to questions that are not part of the dataset are dropped
+        answered_rows = np.flatnonzero(question_positions >= 0)
+        answered_positions = question_positions[answered_rows]
+        grouped_rows = answered_rows[np.argsort(answered_positions, kind='stable')]
+
+        offsets = np.zeros(original_posts_df.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(answered_positions, minlength=original_posts_df.shape[0]), out=offsets[1:])
+
+        return responses_df.iloc[grouped_rows].reset_index(drop=True), offsets
 
     def convert(self) -> dict:
         """
         Given a dataframe, this function turns it into a JSON array with dialogues and utterances
-        :return: JSON dataset
+        :return: JSON dataset, as a dictionary index -> dialogue, each dialogue being a dictionary (see
+        JsonDialogue.as_dict)
+        """
+        return {index: dialogue.as_dict() for index, dialogue in enumerate(self.iter_dialogues())}
+
+    def iter_dialogues(self):
+        """
+        Generates the dialogues one by one, in the chronological order of their questions. The position of a
+        dialogue in the sequence is its index in the JSON dataset
+        :return: Generator of JsonDialogue records, in their compact form: as_dict gives the dialogue of the JSON
+        dataset (see convert)
         """
         original_posts_df = self.df.loc[self.df['PostTypeId'] == '1'].drop_duplicates('Id_post')
         original_posts_df = original_posts_df.reset_index(drop=True)
@@ -107,17 +141,100 @@ class Pandas2JSON:
             (self.df['Text'].isnull() | (~self.df['Text'].isnull() & ~self.df['UserId'].isnull()))
         ]
 
-        responses_df = responses_df.reset_index(drop=True)
+        responses_df, offsets = Pandas2JSON.__group_responses(original_posts_df, responses_df)
+
+        if self.num_workers > 1:
+            yield from self.__convert_parallel(original_posts_df, responses_df, offsets)
+        else:
+            yield from self.__convert_questions(original_posts_df, responses_df, offsets, show_progress=True)
 
+        print(self.filter_pipeline.report())
+        print(self.sentiment_scorer.report())
+
+    def __convert_questions(self, original_posts_df: DataFrame, responses_df: DataFrame, offsets,
+                            show_progress: bool = False):
+        """
+        Generates the dialogues of each question, given the grouped responses
+        :param original_posts_df: The questions
+        :param responses_df: The responses, grouped by question
+        :param offsets: The responses of the i-th question are in the slice offsets[i]:offsets[i + 1]
+        :param show_progress:
+        :return:
+        """
         total_progress_increment = floor(original_posts_df.shape[0] / 100)
 
-        for progress_index, original_post in original_posts_df.iterrows():
-            if progress_index % total_progress_increment == 0:
+        # Plain records (namedtuples) are much cheaper to create and to access than the Series of iterrows
+        responses = list(responses_df.itertuples(index=False, name='Response'))
+        offsets = offsets.tolist()
+
+        for progress_index, original_post in enumerate(original_posts_df.itertuples(index=False, name='Post')):
+            if show_progress and progress_index % total_progress_increment == 0:
                 print('Progress: ' + str(floor(progress_index / total_progress_increment)) + '%')
 
-            original_post_id = original_post['Id_post']
-            responses_df_current = responses_df.loc[responses_df['ParentId'] == original_post_id]
+            responses_current = responses[offsets[progress_index]:offsets[progress_index + 1]]
+
+            self.__generate_dialogues_from_responses(original_post, responses_current)
+
+            yield from self.__accepted_entries
+            self.__accepted_entries = []
+
+    @classmethod
+    def convert_shard(cls, shard: tuple) -> list:
+        """
+        Worker entry point of the parallel mode. Converts a contiguous range of questions with a converter (and
+        sentiment analyzer) of its own
+        :param shard: Tuple (topic, filters, questions, grouped responses, offsets relative to the responses slice)
+        :return: The dialogues of the shard, in order, and the statistics of its filters and sentiment scorer
+        """
+        topic, filters, original_posts_df, responses_df, offsets = shard
+
+        converter = Pandas2JSON(None, topic, filters=filters)
+        dialogues = list(converter.__convert_questions(original_posts_df, responses_df, offsets))
+
+        return (
+            dialogues,
+            converter.filter_pipeline.get_stats(),
+            converter.sentiment_scorer.get_stats()
+        )
+
+    def __get_shard_ranges(self, questions_count: int) -> list:
+        """
+        Splits the questions in contiguous (start, end) ranges
+        :param questions_count:
+        :return:
+        """
+        return ShardHelper.get_shard_ranges(0, questions_count, self.num_workers)
+
+    def __generate_shards(self, shard_ranges: list, original_posts_df: DataFrame, responses_df: DataFrame, offsets):
+        """
+        Yields the questions of each range, together with their slice of the grouped responses
+        :return:
+        """
+        for start, end in shard_ranges:
+            yield (
+                self.topic,
+                self.filter_pipeline.filters,
+                original_posts_df.iloc[start:end].reset_index(drop=True),
+                responses_df.iloc[offsets[start]:offsets[end]].reset_index(drop=True),
+                offsets[start:end + 1] - offsets[start],
+            )
+
+    def __convert_parallel(self, original_posts_df: DataFrame, responses_df: DataFrame, offsets):
+        """
+        Converts the questions across a pool of processes. The shards are merged back in their original order, so
+        the dialogues come out in the same order (and get the same indexes) as in a serial run
+        :return:
+        """
+        print('Converting with ' + str(self.num_workers) + ' workers')
+        shard_ranges = self.__get_shard_ranges(original_posts_df.shape[0])
+        shards = self.__generate_shards(shard_ranges, original_posts_df, responses_df, offsets)
+
+        with Pool(processes=self.num_workers) as pool, tqdm(total=original_posts_df.shape[0]) as pbar:
+            for (dialogues, filter_stats, sentiment_stats), (start, end) in zip(
+                    pool.imap(Pandas2JSON.convert_shard, shards), shard_ranges):
+                yield from dialogues
 
-            self.__generate_dialogues_from_responses(original_post, responses_df_current)
+                self.filter_pipeline.add_stats(filter_stats)
+                self.sentiment_scorer.add_stats(sentiment_stats)
 
-        return self.__output
+                pbar.update(end - start)
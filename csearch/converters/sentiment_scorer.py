@@ -0,0 +1,105 @@
+import hashlib
+from collections import OrderedDict
+from time import perf_counter
+from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+
+class SentimentScorer:
+    """
+    Computes the VADER compound polarity of utterances. Scores are memoized by text hash in a bounded LRU cache,
+    since the candidate dialogues of a question often end with the same user comment. The number of cache hits and
+    misses, as well as the time spent scoring, are kept for reporting.
+    """
+
+    def __init__(self, max_size: int = 100000):
+        self.__analyzer = SentimentIntensityAnalyzer()
+        self.__cache = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.scoring_time = 0.0
+
+    @classmethod
+    def __hash(cls, text: str) -> bytes:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def __lookup(self, key: bytes):
+        score = self.__cache.get(key)
+        if score is not None:
+            self.__cache.move_to_end(key)
+            self.hits += 1
+
+        return score
+
+    def __store(self, key: bytes, score: float) -> None:
+        self.__cache[key] = score
+        if len(self.__cache) > self.max_size:
+            self.__cache.popitem(last=False)
+
+    def __compute(self, text: str) -> float:
+        start = perf_counter()
+        score = self.__analyzer.polarity_scores(text)['compound']
+        self.scoring_time += perf_counter() - start
+        self.misses += 1
+
+        return score
+
+    def score(self, text: str) -> float:
+        """
+        Returns the compound polarity of a text
+        :param text:
+        :return:
+        """
+        key = SentimentScorer.__hash(text)
+        score = self.__lookup(key)
+
+        if score is None:
+            score = self.__compute(text)
+            self.__store(key, score)
+
+        return score
+
+    def score_batch(self, texts: list) -> list:
+        """
+        Returns the compound polarity of each text. Every distinct text of the batch is scored at most once, and counted
+        once in the hits or misses
+        :param texts:
+        :return:
+        """
+        keys = [SentimentScorer.__hash(text) for text in texts]
+        batch_scores = {}
+
+        for key, text in zip(keys, texts):
+            if key in batch_scores:
+                continue
+
+            score = self.__lookup(key)
+            if score is None:
+                score = self.__compute(text)
+                self.__store(key, score)
+
+            batch_scores[key] = score
+
+        return [batch_scores[key] for key in keys]
+
+    def get_stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'scoring_time': self.scoring_time,
+        }
+
+    def add_stats(self, stats: dict) -> None:
+        """
+        Adds the counters of another scorer (e.g. one used by a worker process) to this one
+        :param stats: As returned by get_stats
+        :return:
+        """
+        self.hits += stats['hits']
+        self.misses += stats['misses']
+        self.scoring_time += stats['scoring_time']
+
+    def report(self) -> str:
+        return 'Sentiment scoring: {} hits, {} misses, {:.2f}s spent in VADER'.format(
+            self.hits, self.misses, self.scoring_time
+        )
@@ -1,19 +1,69 @@
 import xml.etree.ElementTree as ET
 import pandas as pd
+from math import nan
 
 
 class XML2Pandas:
+    """
+    Streams a StackExchange dump file (one <row> element per record) into a pandas DataFrame. The file is parsed
+    incrementally and every element is cleared as soon as its attributes are read, so the whole tree is never held in
+    memory. Only the requested columns are kept and the frame is filled in fixed-size chunks.
+    """
 
-    def __init__(self, filename):
-        data = ET.parse(filename)
-        self.root = data.getroot()
+    def __init__(self, filename: str, columns: list = None, chunk_size: int = 100000, row_filter=None):
+        """
+        :param filename: Path to the .xml file
+        :param columns: The attributes to keep. If None, every attribute encountered is kept
+        :param chunk_size: Number of rows accumulated before they are turned into a DataFrame chunk
+        :param row_filter: Optional callable receiving the attributes of a row. Rows for which it returns False
+        are skipped
+        """
+        self.filename = filename
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.row_filter = row_filter
 
-    def parse_root(self, root):
-        """Return a list of dictionaries from the text and attributes of the
-        children under this XML root."""
-        return [child.attrib for child in root.getchildren()]
+    def __build_chunk(self, rows: list) -> pd.DataFrame:
+        if self.columns is None:
+            return pd.DataFrame(rows)
 
-    def convert(self):
-        """ Initiate the root XML, parse it, and return a dataframe"""
-        structure_data = self.parse_root(self.root)
-        return pd.DataFrame(structure_data)
+        return pd.DataFrame.from_records(rows, columns=self.columns)
+
+    def iter_chunks(self):
+        """
+        Parses the file incrementally and yields DataFrames of at most chunk_size rows
+        :return:
+        """
+        context = ET.iterparse(self.filename, events=('start', 'end'))
+        _, root = next(context)
+
+        rows = []
+        for event, element in context:
+            if event != 'end' or element.tag != 'row':
+                continue
+
+            attributes = element.attrib
+            if self.row_filter is None or self.row_filter(attributes):
+                if self.columns is None:
+                    rows.append(dict(attributes))
+                else:
+                    rows.append(tuple(attributes.get(column, nan) for column in self.columns))
+
+            # Drop the processed element (and any sibling already read) from the partially built tree
+            root.clear()
+
+            if len(rows) >= self.chunk_size:
+                yield self.__build_chunk(rows)
+                rows = []
+
+        if rows:
+            yield self.__build_chunk(rows)
+
+    def convert(self) -> pd.DataFrame:
+        """ Parse the XML incrementally and return a dataframe"""
+        chunks = list(self.iter_chunks())
+
+        if not chunks:
+            return pd.DataFrame(columns=self.columns)
+
+        return pd.concat(chunks, ignore_index=True)
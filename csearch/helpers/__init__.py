@@ -2,3 +2,11 @@ from csearch.helpers.bm25_helper import BM25Helper
 from csearch.helpers.dataset_helper import DatasetHelper
 from csearch.helpers.web_dataset_helper import WebDatasetHelper
 from csearch.helpers.file_helper import FileHelper
+from csearch.helpers.text_helper import TextHelper
+from csearch.helpers.dump_cache_helper import DumpCacheHelper
+from csearch.helpers.json_dataset_writer import JsonDatasetWriter
+from csearch.helpers.bm25_index import BM25Index
+from csearch.helpers.training_set_store import TrainingSetWriter, TrainingSetReader
+from csearch.helpers.training_set_tsv_reader import TrainingSetTsvReader
+from csearch.helpers.pipeline_helper import PipelineHelper
+from csearch.helpers.shard_helper import ShardHelper
@@ -1,75 +1,277 @@
 import numpy as np
-np.random.seed(10)
-import spacy
-from gensim.summarization.bm25 import BM25
-from math import floor
-from tqdm import tqdm
+from collections import OrderedDict
+from multiprocessing import Pool
+from csearch.helpers.bm25_index import BM25Index
+from csearch.helpers.bm25_tokenizer import BM25Tokenizer
+from csearch.helpers.text_helper import TextHelper
 
 
 class BM25Helper:
-    def __init__(self, raw_corpus: list, processed_corpus: list = None):
-        self.__pipeline = spacy.load('en_core_web_sm', disable=["parser", "tagger", "ner"])
+    # Size of the set of best BM25 matches the negative samples are drawn from
+    CANDIDATES_COUNT = 1000
+    # Number of tokenized queries that are not documents of the corpus kept in memory
+    QUERY_CACHE_SIZE = 10000
+
+    def __init__(self, raw_corpus: list, processed_corpus: list = None, index_folder: str = None,
+                 tokenizer_only: bool = True, n_process: int = 1, batch_size: int = 1000,
+                 tokenizer: BM25Tokenizer = None, model: BM25Index = None, multiplicities: list = None):
+        """
+        :param raw_corpus: The documents, as text
+        :param processed_corpus: The documents, already pre-processed (see bm25_pre_process_utterance)
+        :param index_folder: Where the BM25 index of the corpus is persisted. If it already holds an index of a corpus
+        of the same size, built with the same pre-processing (see BM25Tokenizer.get_pre_processing), that index is
+        memory-mapped instead of pre-processing the corpus again. The caller is
+        responsible for choosing a folder that identifies the corpus (see FileHelper.get_files_hash)
+        :param tokenizer_only: See BM25Tokenizer
+        :param n_process: Number of processes used to pre-process the corpus
+        :param batch_size: Number of documents pre-processed at once
+        :param tokenizer: Tokenizer to use (e.g. the one of another helper) instead of loading a new one
+        :param model: Already built index of the corpus
+        :param multiplicities: For a deduplicated corpus, the number of times each document occurs in the original
+        one. The BM25 statistics then count the duplicates, so that the scores are the ones of the original corpus.
+        If None, each document counts once
+        """
+        self.tokenizer = BM25Tokenizer(tokenizer_only) if tokenizer is None else tokenizer
+        self.n_process = n_process
+        self.batch_size = batch_size
         self.raw_corpus = raw_corpus
-        self.processed_corpus = self.__pre_process_corpus() if processed_corpus is None else processed_corpus
-        self.raw_corpus = np.array(self.raw_corpus)
-        self.model = BM25(self.processed_corpus)
+        self.multiplicities = multiplicities
+        self.index_folder = index_folder
+        self.model = self.__load_index(index_folder) if model is None else model
+
+        if self.model is None:
+            processed_corpus = self.__pre_process_corpus() if processed_corpus is None else processed_corpus
+            self.model = BM25Index(processed_corpus, multiplicities=multiplicities)
+
+            if index_folder is not None:
+                self.model.save(index_folder, self.tokenizer.get_pre_processing())
+
+        # Text hash -> index of the first document with that text (its document ID). Queries that are documents of
+        # the corpus are read from the index instead of tokenizing them again
+        self.__document_indexes = {}
+        # Document ID of each document: documents with the same text share the same ID
+        self.__document_ids = np.zeros(len(self.raw_corpus), dtype=np.int64)
+        for index, document in enumerate(self.raw_corpus):
+            self.__document_ids[index] = self.__document_indexes.setdefault(TextHelper.get_text_hash(document), index)
+
+        self.__query_cache = OrderedDict()
+        self.__prefetched_candidates = {}
+
+    def __load_index(self, index_folder: str):
+        if index_folder is None or not BM25Index.is_saved(index_folder):
+            return None
+
+        if not BM25Index.is_saved(index_folder, self.tokenizer.get_pre_processing()):
+            print('The BM25 index of ' + index_folder + ' was built with another pre-processing, rebuilding it')
+            return None
+
+        print('Loading the BM25 index from ' + index_folder)
+        model = BM25Index.load(index_folder)
+
+        expected_multiplicities = np.ones(len(self.raw_corpus), dtype=np.int64) if self.multiplicities is None \
+            else self.multiplicities
+
+        if model.corpus_size != len(self.raw_corpus) or \
+                not np.array_equal(model.multiplicities, expected_multiplicities):
+            print('The BM25 index does not match the corpus, rebuilding it')
+            return None
+
+        return model
+
+    @classmethod
+    def build_subset_index(cls, subset: tuple):
+        """
+        Worker entry point of build_subset_helpers. Builds the index of a subset of the corpus and, if a folder is
+        given, saves it there instead of sending it back
+        :param subset: Tuple (pre-processed documents, multiplicities or None, index folder or None, pre-processing
+        saved with the index)
+        :return: The index, or None if it was saved
+        """
+        processed_corpus, multiplicities, index_folder, pre_processing = subset
+        model = BM25Index(processed_corpus, multiplicities=multiplicities)
+
+        if index_folder is None:
+            return model
+
+        model.save(index_folder, pre_processing)
+
+    def build_subset_helpers(self, subsets: dict, index_folder: str = None) -> dict:
+        """
+        Builds the helpers of several subsets of the corpus (e.g. the documents of each topic), reusing the
+        pre-processed documents and the tokenizer of this helper. The indexes that are not already persisted are
+        built with n_process processes
+        :param subsets: Dictionary name -> indexes of the documents of the subset, in order. An index can be repeated
+        (e.g. when the same text occurs several times in a topic): the subset then holds the document once and, if
+        this helper counts duplicates (see multiplicities in __init__), with the number of repetitions as multiplicity
+        :param index_folder: If given, the index of each subset is persisted in index_folder/name (see __init__)
+        :return: Dictionary name -> BM25Helper
+        """
+        # Subset name -> (document index -> number of repetitions), in order of first occurrence
+        subset_counts = {}
+        for name, document_indexes in subsets.items():
+            counts = {}
+            for index in document_indexes:
+                counts[index] = counts.get(index, 0) + 1
+            subset_counts[name] = counts
+
+        subset_multiplicities = {
+            name: list(counts.values()) if self.multiplicities is not None else None
+            for name, counts in subset_counts.items()
+        }
+
+        subset_folders = {name: None if index_folder is None else index_folder + '/' + name for name in subsets}
+        pre_processing = self.tokenizer.get_pre_processing()
+        missing_subsets = [name for name in subsets if subset_folders[name] is None or
+                           not BM25Index.is_saved(subset_folders[name], pre_processing)]
+
+        tasks = (
+            (
+                [self.model.get_document(index) for index in subset_counts[name]],
+                subset_multiplicities[name],
+                subset_folders[name],
+                pre_processing
+            )
+            for name in missing_subsets
+        )
+
+        if self.n_process > 1 and len(missing_subsets) > 1:
+            print('Building ' + str(len(missing_subsets)) + ' BM25 indexes with ' + str(self.n_process) + ' processes')
+            with Pool(processes=self.n_process) as pool:
+                models = dict(zip(missing_subsets, pool.imap(BM25Helper.build_subset_index, tasks)))
+        else:
+            models = dict(zip(missing_subsets, map(BM25Helper.build_subset_index, tasks)))
+
+        subset_helpers = {}
+        for name, counts in subset_counts.items():
+            print('Building BM25 corpus for topic: ' + name)
+            subset_helpers[name] = BM25Helper(
+                [self.raw_corpus[index] for index in counts],
+                index_folder=subset_folders[name],
+                n_process=self.n_process,
+                batch_size=self.batch_size,
+                tokenizer=self.tokenizer,
+                model=models.get(name),
+                multiplicities=subset_multiplicities[name]
+            )
+
+        return subset_helpers
 
     def bm25_pre_process_utterance(self, query: str) -> list:
         """
-        Tokenizes a utterance and removes stopwords and punctuation
+        Tokenizes a utterance and removes stopwords and punctuation. Documents of the corpus are not tokenized again,
+        and the tokens of the last QUERY_CACHE_SIZE other queries are kept, as the same texts are queried repeatedly
+        (e.g. a web page cited in several dialogues). The returned list must not be modified
         :param query:
         :return:
         """
-        doc = self.__pipeline(query)
-        return [token.text.lower() for token in doc if not token.is_stop and not token.is_punct]
+        key = TextHelper.get_text_hash(query)
+
+        document_index = self.__document_indexes.get(key)
+        if document_index is not None:
+            return self.model.get_document(document_index)
+
+        terms = self.__query_cache.get(key)
+        if terms is not None:
+            self.__query_cache.move_to_end(key)
+            return terms
+
+        terms = self.tokenizer.tokenize(query)
+        self.__query_cache[key] = terms
+        if len(self.__query_cache) > BM25Helper.QUERY_CACHE_SIZE:
+            self.__query_cache.popitem(last=False)
+
+        return terms
 
     def __pre_process_corpus(self) -> list:
         """
         Prepares each utterance in the corpus to be fed to BM25
         :return:
         """
-        processed_corpus = []
-
         print('Pre-processing the agent corpus in order to apply BM25...')
 
-        corpus_size = len(self.raw_corpus)
-        i = 0
+        return self.tokenizer.tokenize_corpus(self.raw_corpus, self.n_process, self.batch_size)
+
+    def compare_pre_processing(self, texts: list) -> list:
+        """
+        See BM25Tokenizer.compare_pre_processing
+        :param texts:
+        :return:
+        """
+        return self.tokenizer.compare_pre_processing(texts)
+
+    def prefetch_candidates(self, queries: list) -> None:
+        """
+        Computes the top candidates of a batch of queries at once (see BM25Index.get_top_n_batch). The following
+        get_negative_samples calls for these queries use them instead of scoring the corpus again. The candidates of
+        the previous batch are discarded
+        :param queries:
+        :return:
+        """
+        queries = list(dict.fromkeys(queries))
+        processed_queries = [self.bm25_pre_process_utterance(query) for query in queries]
+        top_candidates = self.model.get_top_n_batch(processed_queries, BM25Helper.CANDIDATES_COUNT)
+
+        self.__prefetched_candidates = dict(zip(queries, top_candidates))
 
-        with tqdm(total=corpus_size) as pbar:
-            for doc in self.__pipeline.pipe(self.raw_corpus):
-                processed_corpus.append([token.text.lower() for token in doc if not token.is_stop and not token.is_punct])
-                pbar.update(1)
-                i += 1
+    def __get_candidates(self, query: str) -> np.ndarray:
+        candidates = self.__prefetched_candidates.get(query)
+        if candidates is not None:
+            return candidates
 
-        return processed_corpus
+        processed_query = self.bm25_pre_process_utterance(query)
 
-    def get_negative_samples(self, query: str,  n: int, existing_negative_samples: list = []) -> list:
+        scores = self.model.get_scores(processed_query)
+        subset_length = min(BM25Helper.CANDIDATES_COUNT, len(scores))
+
+        return np.argpartition(scores, -subset_length)[-subset_length:]
+
+    def get_document_index(self, text: str):
+        """
+        Returns the document ID of a text (the index of the first document of the corpus with that text)
+        :param text:
+        :return: The ID, or None if the text is not part of the corpus
+        """
+        return self.__document_indexes.get(TextHelper.get_text_hash(text))
+
+    def get_document(self, index: int) -> str:
+        """
+        Returns the text of a document of the corpus
+        :param index:
+        :return:
+        """
+        return self.raw_corpus[index]
+
+    def get_negative_samples(self, query: str, n: int, random_generator: np.random.Generator,
+                             existing_negative_samples: list = ()) -> list:
         """
         Given a query, this function returns a sample of n responses from the top 1000 potential responses obtained
-        by applying BM25
+        by applying BM25. The sampled responses have distinct texts, none of which is in existing_negative_samples.
+        If the top responses do not contain enough distinct texts, fewer than n are returned
         :param query:
         :param n:
-        :return:
+        :param random_generator: Generator the samples are drawn with. For the same query and generator state, the
+        samples are always the same
+        :param existing_negative_samples: Document IDs to leave out
+        :return: The document IDs of the responses (see get_document_index and get_document)
         """
-        processed_query = self.bm25_pre_process_utterance(query)
-
-        scores = np.array(self.model.get_scores(processed_query))
-        subset_length = min(1000, len(scores))
-        top_queries = np.argpartition(scores, -subset_length)[-subset_length:]
+        candidates = self.__document_ids[self.__get_candidates(query)]
+        excluded = set(existing_negative_samples)
+        samples_count = min(n, len(set(candidates.tolist()) - excluded))
+        samples = []
 
-        top_indexes = np.random.choice(top_queries, n, replace=False)
-        unique_responses = list(set(self.raw_corpus[top_indexes]))
+        for document_id in random_generator.choice(candidates, min(n, len(candidates)), replace=False).tolist():
+            if document_id not in excluded:
+                excluded.add(document_id)
+                samples.append(document_id)
 
-        while len(unique_responses) < n:
-            candidate_element = np.random.choice(top_queries, 1)[0]
-            if candidate_element not in unique_responses and candidate_element not in existing_negative_samples:
-                unique_responses.append(candidate_element)
+        while len(samples) < samples_count:
+            document_id = int(random_generator.choice(candidates))
+            if document_id not in excluded:
+                excluded.add(document_id)
+                samples.append(document_id)
 
-        return unique_responses
+        return samples
 
     def get_top_n(self, query: str, n: int) -> list:
         processed_query = self.bm25_pre_process_utterance(query)
-        scores = np.array(self.model.get_scores(processed_query))
-        top_queries = np.argpartition(scores, -n)[-n:]
-
-        return top_queries
+        return self.model.get_top_n(processed_query, n)
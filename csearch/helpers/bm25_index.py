@@ -0,0 +1,377 @@
+import os
+import json
+import math
+import numpy as np
+from scipy.sparse import csr_matrix
+
+PARAM_K1 = 1.5
+PARAM_B = 0.75
+EPSILON = 0.25
+
+# Version of the on-disk format written by BM25Index.save. Indexes saved with another version are rebuilt
+INDEX_FORMAT_VERSION = 2
+
+# Maximum number of queries scored by a single sparse product (each one produces a dense row of corpus_size scores)
+QUERY_BLOCK_SIZE = 256
+# Memory budget of a block of queries: its dense scores, and the indexes argpartition returns for them
+SCORE_BLOCK_BYTES = 256 * 1024 * 1024
+
+
+class BM25Index:
+    """
+    Okapi BM25 over an inverted index. For every term, the documents containing it and the term frequencies are stored
+    contiguously (postings), so scoring a query only touches the documents that contain at least one of its terms.
+    The scores are the same as the ones of gensim.summarization.bm25.BM25 (same parameters, same idf smoothing and
+    same order of the floating point operations)
+    The tokens of each document are kept as well (forward index), so the tokenized corpus never has to be rebuilt.
+    A deduplicated corpus can be indexed with the multiplicity of each document, in which case the corpus statistics
+    (idf, average document length) are the ones of the corpus with its duplicates
+    """
+    # Arrays written by save, and memory-mapped by load
+    ARRAY_NAMES = [
+        'doc_len', 'doc_freqs', 'term_offsets', 'posting_docs', 'posting_freqs', 'idf', 'document_tokens',
+        'document_offsets', 'multiplicities',
+    ]
+
+    def __init__(self, corpus: list, k1: float = PARAM_K1, b: float = PARAM_B, epsilon: float = EPSILON,
+                 multiplicities: list = None):
+        """
+        :param corpus: List of tokenized documents
+        :param k1:
+        :param b:
+        :param epsilon: Terms with a negative idf get epsilon * the average idf instead
+        :param multiplicities: Number of times each document occurs in the original corpus (1 for all if None)
+        """
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.corpus_size = len(corpus)
+        self.multiplicities = np.ones(self.corpus_size, dtype=np.int64) if multiplicities is None \
+            else np.array(multiplicities, dtype=np.int64)
+        # Number of documents of the original corpus, counting duplicates
+        self.document_count = int(self.multiplicities.sum())
+
+        # Term -> term id, in the order in which the terms are first seen
+        self.vocabulary = {}
+        self.doc_len = np.zeros(self.corpus_size, dtype=np.int64)
+        self.__build_postings(corpus)
+
+        self.avgdl = float((self.doc_len * self.multiplicities).sum()) / self.document_count
+        self.__build_idf()
+        self.__denominator_constants = self.__get_denominator_constants(self.k1, self.b)
+        self.__weight_matrix = None
+        self.__terms = None
+
+    def __build_postings(self, corpus: list) -> None:
+        """
+        Builds the postings of each term, in CSR form: the postings of the term t are the slice
+        term_offsets[t]:term_offsets[t + 1] of posting_docs / posting_freqs, ordered by document.
+        The tokens of the document d are the slice document_offsets[d]:document_offsets[d + 1] of document_tokens
+        :param corpus:
+        :return:
+        """
+        term_ids = []
+        doc_ids = []
+        freqs = []
+        document_tokens = []
+        self.document_offsets = np.zeros(self.corpus_size + 1, dtype=np.int64)
+
+        for index, document in enumerate(corpus):
+            self.doc_len[index] = len(document)
+
+            frequencies = {}
+            for word in document:
+                frequencies[word] = frequencies.get(word, 0) + 1
+                document_tokens.append(self.vocabulary.setdefault(word, len(self.vocabulary)))
+
+            self.document_offsets[index + 1] = len(document_tokens)
+
+            for word, freq in frequencies.items():
+                term_ids.append(self.vocabulary[word])
+                doc_ids.append(index)
+                freqs.append(freq)
+
+        term_ids = np.array(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind='stable')
+
+        self.doc_freqs = np.bincount(term_ids, minlength=len(self.vocabulary))
+        self.term_offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(self.doc_freqs, out=self.term_offsets[1:])
+
+        self.posting_docs = np.array(doc_ids, dtype=np.int32)[order]
+        self.posting_freqs = np.array(freqs, dtype=np.float64)[order]
+        self.document_tokens = np.array(document_tokens, dtype=np.int32)
+
+    def __build_idf(self) -> None:
+        self.idf = np.zeros(len(self.vocabulary), dtype=np.float64)
+        idf_sum = 0
+        negative_idfs = []
+
+        # Number of documents of the original corpus containing each term
+        posting_terms = np.repeat(np.arange(len(self.vocabulary)), self.doc_freqs)
+        document_freqs = np.bincount(
+            posting_terms, weights=self.multiplicities[self.posting_docs], minlength=len(self.vocabulary)
+        ).astype(np.int64)
+
+        # Plain Python arithmetic, in vocabulary order, so that the average idf is exactly gensim's
+        for term_id, freq in enumerate(document_freqs.tolist()):
+            idf = math.log(self.document_count - freq + 0.5) - math.log(freq + 0.5)
+            self.idf[term_id] = idf
+            idf_sum += idf
+
+            if idf < 0:
+                negative_idfs.append(term_id)
+
+        self.average_idf = float(idf_sum) / len(self.vocabulary)
+        self.idf[negative_idfs] = self.epsilon * self.average_idf
+
+    def __get_denominator_constants(self, k1: float, b: float) -> np.ndarray:
+        return k1 * (1 - b + b * self.doc_len / self.avgdl)
+
+    def __get_postings(self, word: str) -> tuple:
+        term_id = self.vocabulary.get(word)
+        if term_id is None:
+            return None, None, None
+
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+
+        return self.idf[term_id], self.posting_docs[start:end], self.posting_freqs[start:end]
+
+    def get_document(self, index: int) -> list:
+        """
+        Returns the tokens of a document of the corpus, as they were indexed
+        :param index:
+        :return:
+        """
+        if self.__terms is None:
+            self.__terms = list(self.vocabulary)
+
+        document_tokens = self.document_tokens[self.document_offsets[index]:self.document_offsets[index + 1]]
+
+        return [self.__terms[term_id] for term_id in document_tokens.tolist()]
+
+    def save(self, folder: str, pre_processing: dict = None) -> None:
+        """
+        Writes the index to a folder, one .npy file per array
+        :param folder:
+        :param pre_processing: Description of how the documents were turned into terms (see
+        BM25Tokenizer.get_pre_processing), kept with the index so that it is not loaded for other queries
+        :return:
+        """
+        os.makedirs(folder, exist_ok=True)
+
+        for name in BM25Index.ARRAY_NAMES:
+            np.save(folder + '/' + name + '.npy', getattr(self, name))
+
+        with open(folder + '/vocabulary.json', 'w') as f:
+            json.dump(list(self.vocabulary), f)
+
+        metadata = {
+            'version': INDEX_FORMAT_VERSION,
+            'k1': self.k1,
+            'b': self.b,
+            'epsilon': self.epsilon,
+            'corpus_size': self.corpus_size,
+            'document_count': self.document_count,
+            'avgdl': self.avgdl,
+            'average_idf': self.average_idf,
+            'pre_processing': pre_processing,
+        }
+
+        # The metadata is written last: a folder without it holds an incomplete index and is never loaded
+        with open(folder + '/metadata.json.tmp', 'w') as f:
+            json.dump(metadata, f)
+        os.replace(folder + '/metadata.json.tmp', folder + '/metadata.json')
+
+    @classmethod
+    def __read_metadata(cls, folder: str):
+        try:
+            with open(folder + '/metadata.json', 'r') as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        return metadata if metadata.get('version') == INDEX_FORMAT_VERSION else None
+
+    @classmethod
+    def is_saved(cls, folder: str, pre_processing: dict = None) -> bool:
+        """
+        Whether the folder holds a complete index, written with the current format
+        :param folder:
+        :param pre_processing: If given, the index must also have been saved with the same pre-processing (see save)
+        :return:
+        """
+        metadata = BM25Index.__read_metadata(folder)
+        if metadata is None:
+            return False
+
+        return pre_processing is None or metadata.get('pre_processing') == pre_processing
+
+    @classmethod
+    def load(cls, folder: str):
+        """
+        Loads an index written by save. The arrays are memory-mapped (read-only), so loading is almost immediate and
+        processes forked afterwards share the same pages
+        :param folder:
+        :return: BM25Index
+        """
+        metadata = BM25Index.__read_metadata(folder)
+        if metadata is None:
+            raise ValueError('No BM25 index found in ' + folder)
+
+        index = cls.__new__(cls)
+        index.k1 = metadata['k1']
+        index.b = metadata['b']
+        index.epsilon = metadata['epsilon']
+        index.corpus_size = metadata['corpus_size']
+        index.document_count = metadata['document_count']
+        index.avgdl = metadata['avgdl']
+        index.average_idf = metadata['average_idf']
+
+        for name in BM25Index.ARRAY_NAMES:
+            setattr(index, name, np.load(folder + '/' + name + '.npy', mmap_mode='r'))
+
+        with open(folder + '/vocabulary.json', 'r') as f:
+            index.__terms = json.load(f)
+        index.vocabulary = {term: term_id for term_id, term in enumerate(index.__terms)}
+
+        index.__denominator_constants = index.__get_denominator_constants(index.k1, index.b)
+        index.__weight_matrix = None
+
+        return index
+
+    def get_score(self, document: list, index: int, k1: float = None, b: float = None) -> float:
+        """
+        Computes the BM25 score of a tokenized query against one document of the corpus
+        :param document: The tokenized query
+        :param index: Index of the document in the corpus
+        :param k1: Overrides the k1 of the index (the idf does not depend on it)
+        :param b: Overrides the b of the index (the idf does not depend on it)
+        :return:
+        """
+        k1 = self.k1 if k1 is None else k1
+        b = self.b if b is None else b
+
+        score = 0.0
+        numerator_constant = k1 + 1
+        denominator_constant = k1 * (1 - b + b * int(self.doc_len[index]) / self.avgdl)
+
+        for word in document:
+            idf, docs, freqs = self.__get_postings(word)
+            if idf is None:
+                continue
+
+            position = np.searchsorted(docs, index)
+            if position < len(docs) and docs[position] == index:
+                df = float(freqs[position])
+                score += (float(idf) * df * numerator_constant) / (df + denominator_constant)
+
+        return score
+
+    def get_scores(self, document: list) -> np.ndarray:
+        """
+        Computes the BM25 score of a tokenized query against every document of the corpus. Repeated query terms
+        count once per occurrence, as in gensim
+        :param document: The tokenized query
+        :return: Array with one score per document
+        """
+        scores = np.zeros(self.corpus_size, dtype=np.float64)
+        numerator_constant = self.k1 + 1
+
+        for word in document:
+            idf, docs, freqs = self.__get_postings(word)
+            if idf is None:
+                continue
+
+            scores[docs] += (idf * freqs * numerator_constant) / (freqs + self.__denominator_constants[docs])
+
+        return scores
+
+    def get_top_n(self, document: list, n: int) -> np.ndarray:
+        """
+        Returns the indexes of the n best scoring documents for a tokenized query (in no particular order)
+        :param document: The tokenized query
+        :param n:
+        :return:
+        """
+        scores = self.get_scores(document)
+        n = min(n, self.corpus_size)
+
+        return np.argpartition(scores, -n)[-n:]
+
+    def get_weight_matrix(self) -> csr_matrix:
+        """
+        Returns the (terms x documents) matrix of the BM25 weight of each term in each document, for the k1 and b of
+        the index. It shares the postings of the index and is only built the first time it is needed
+        :return:
+        """
+        if self.__weight_matrix is None:
+            posting_terms = np.repeat(np.arange(len(self.vocabulary)), self.doc_freqs)
+            weights = (self.idf[posting_terms] * self.posting_freqs * (self.k1 + 1)) / (
+                self.posting_freqs + self.__denominator_constants[self.posting_docs]
+            )
+
+            self.__weight_matrix = csr_matrix(
+                (weights, self.posting_docs, self.term_offsets),
+                shape=(len(self.vocabulary), self.corpus_size)
+            )
+
+        return self.__weight_matrix
+
+    def __build_query_matrix(self, documents: list) -> csr_matrix:
+        """
+        Builds the (queries x terms) matrix of the terms of each query. Every occurrence of a term is stored as its
+        own entry (duplicates are not summed), in the order of the query, so that the sparse product accumulates the
+        scores exactly like get_scores does
+        :param documents: The tokenized queries
+        :return:
+        """
+        indptr = [0]
+        indices = []
+
+        for document in documents:
+            indices += [self.vocabulary[word] for word in document if word in self.vocabulary]
+            indptr.append(len(indices))
+
+        return csr_matrix(
+            (np.ones(len(indices), dtype=np.float64), np.array(indices, dtype=np.int32),
+             np.array(indptr, dtype=np.int64)),
+            shape=(len(documents), len(self.vocabulary))
+        )
+
+    def get_scores_batch(self, documents: list) -> np.ndarray:
+        """
+        Scores several tokenized queries at once, with a single sparse matrix product. The scores are exactly those
+        of get_scores
+        :param documents: The tokenized queries
+        :return: Array (queries x documents) of scores
+        """
+        return (self.__build_query_matrix(documents) @ self.get_weight_matrix()).toarray()
+
+    def get_query_block_size(self) -> int:
+        """
+        Returns the number of queries get_top_n_batch scores at once: QUERY_BLOCK_SIZE, or fewer for large corpora, so
+        that the dense scores of a block and their argpartition (8 bytes per document each) fit in SCORE_BLOCK_BYTES
+        :return:
+        """
+        return max(1, min(QUERY_BLOCK_SIZE, SCORE_BLOCK_BYTES // (16 * max(1, self.corpus_size))))
+
+    def get_top_n_batch(self, documents: list, n: int, block_size: int = None) -> list:
+        """
+        Returns, for each tokenized query, the indexes of its n best scoring documents (in no particular order). The
+        queries are scored in blocks, to bound the size of the dense score matrix
+        :param documents: The tokenized queries
+        :param n:
+        :param block_size: Number of queries per block. Defaults to get_query_block_size
+        :return: One array of indexes per query
+        """
+        n = min(n, self.corpus_size)
+        block_size = self.get_query_block_size() if block_size is None else block_size
+        top_n = []
+
+        for block_start in range(0, len(documents), block_size):
+            scores = self.get_scores_batch(documents[block_start:block_start + block_size])
+            # Copied, so that the rows do not keep the whole (block x corpus) argpartition alive
+            top_n += list(np.argpartition(scores, -n, axis=1)[:, -n:].copy())
+
+        return top_n
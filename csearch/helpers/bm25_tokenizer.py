@@ -0,0 +1,152 @@
+from multiprocessing import Pool
+import spacy
+from spacy.attrs import ORTH
+from tqdm import tqdm
+
+
+class BM25Tokenizer:
+    """
+    Turns text into BM25 terms: the spaCy tokens, lowercased, without stopwords and punctuation
+    """
+    # Tokenizer of each worker process of tokenize_corpus (see init_worker)
+    __worker_tokenizer = None
+
+    def __init__(self, tokenizer_only: bool = True, pipeline=None):
+        """
+        :param tokenizer_only: Tokenize with the tokenizer of the spaCy model alone, instead of running its whole
+        pipeline. Stopwords and punctuation are attributes of the vocabulary, so the result is the same (see
+        compare_pre_processing)
+        :param pipeline: spaCy pipeline to use (e.g. the one of another tokenizer). en_core_web_sm is loaded if None
+        """
+        self.pipeline = spacy.load('en_core_web_sm', disable=["parser", "tagger", "ner"]) if pipeline is None \
+            else pipeline
+        self.tokenizer_only = tokenizer_only
+        # A given pipeline is handed to the worker processes of tokenize_corpus, which otherwise load the default one
+        self.__custom_pipeline = pipeline
+        # Vocabulary entry (orth id) -> lowercase term, or None for stopwords and punctuation
+        self.__lexeme_terms = {}
+
+    def get_pre_processing(self) -> dict:
+        """
+        Describes everything the terms of a text depend on: the spaCy version, the model and whether the tokenizer runs
+        alone. The terms of an index built with another pre-processing may not match the ones of the queries
+        :return:
+        """
+        return {
+            'spacy_version': spacy.__version__,
+            'model': self.pipeline.meta.get('lang', '') + '_' + self.pipeline.meta.get('name', ''),
+            'model_version': self.pipeline.meta.get('version'),
+            'tokenizer_only': self.tokenizer_only,
+        }
+
+    def __get_terms(self, doc) -> list:
+        """
+        Returns the lowercase tokens of a spaCy Doc that are neither stopwords nor punctuation. The decision only
+        depends on the vocabulary entry of a token, so it is computed once per entry
+        :param doc:
+        :return:
+        """
+        lexeme_terms = self.__lexeme_terms
+        terms = []
+
+        for orth in doc.to_array(ORTH).tolist():
+            if orth not in lexeme_terms:
+                lexeme = self.pipeline.vocab[orth]
+                lexeme_terms[orth] = None if lexeme.is_stop or lexeme.is_punct else lexeme.text.lower()
+
+            term = lexeme_terms[orth]
+            if term is not None:
+                terms.append(term)
+
+        return terms
+
+    def tokenize(self, text: str) -> list:
+        """
+        Tokenizes a text and removes stopwords and punctuation
+        :param text:
+        :return:
+        """
+        return self.__get_terms(self.pipeline.tokenizer(text) if self.tokenizer_only else self.pipeline(text))
+
+    def tokenize_batch(self, texts, batch_size: int = 1000):
+        """
+        Tokenizes several texts (see tokenize), streaming them through spaCy in batches
+        :param texts:
+        :param batch_size: Number of texts spaCy processes at once
+        :return: Generator of the terms of each text, in order
+        """
+        docs = self.pipeline.tokenizer.pipe(texts, batch_size=batch_size) if self.tokenizer_only \
+            else self.pipeline.pipe(texts, batch_size=batch_size)
+
+        for doc in docs:
+            yield self.__get_terms(doc)
+
+    @classmethod
+    def init_worker(cls, tokenizer_only: bool, pipeline=None) -> None:
+        """
+        Initializer of the worker processes of tokenize_corpus, which load their own spaCy pipeline
+        :param tokenizer_only:
+        :param pipeline: The pipeline given to the tokenizer of the parent process, if any (see __init__)
+        :return:
+        """
+        BM25Tokenizer.__worker_tokenizer = BM25Tokenizer(tokenizer_only, pipeline)
+
+    @classmethod
+    def tokenize_worker_batch(cls, texts: list) -> list:
+        """
+        Worker entry point of tokenize_corpus
+        :param texts:
+        :return:
+        """
+        return list(BM25Tokenizer.__worker_tokenizer.tokenize_batch(texts, len(texts)))
+
+    def tokenize_corpus(self, texts: list, n_process: int = 1, batch_size: int = 1000) -> list:
+        """
+        Tokenizes a whole corpus, optionally across several processes. The documents keep their order
+        :param texts:
+        :param n_process: Number of processes. Each of them loads its own spaCy pipeline, or receives a copy of the
+        pipeline given to this tokenizer
+        :param batch_size: Number of texts processed at once (and sent to a process as a single task)
+        :return: The terms of each text
+        """
+        processed_texts = []
+
+        with tqdm(total=len(texts)) as pbar:
+            if n_process <= 1:
+                for terms in self.tokenize_batch(texts, batch_size):
+                    processed_texts.append(terms)
+                    pbar.update(1)
+
+                return processed_texts
+
+            batches = (texts[start:start + batch_size] for start in range(0, len(texts), batch_size))
+
+            with Pool(processes=n_process, initializer=BM25Tokenizer.init_worker,
+                      initargs=(self.tokenizer_only, self.__custom_pipeline)) as pool:
+                for batch_terms in pool.imap(BM25Tokenizer.tokenize_worker_batch, batches):
+                    processed_texts += batch_terms
+                    pbar.update(len(batch_terms))
+
+        return processed_texts
+
+    def compare_pre_processing(self, texts: list) -> list:
+        """
+        Equivalence check of the tokenizer-only pre-processing: runs both the full spaCy pipeline (with the original
+        token by token filtering) and the tokenizer alone over the given texts, and returns the texts for which the
+        resulting terms differ. An empty list means the two modes are interchangeable for these texts, e.g.
+        tokenizer.compare_pre_processing(corpus[:10000]) == []. See compare_bm25_pre_processing.py
+        :param texts:
+        :return: List of (position of the text, terms of the full pipeline, terms of the tokenizer alone) tuples
+        """
+        pipeline_docs = self.pipeline.pipe(texts)
+        tokenizer_docs = self.pipeline.tokenizer.pipe(texts)
+        mismatches = []
+
+        for position, (pipeline_doc, tokenizer_doc) in enumerate(zip(pipeline_docs, tokenizer_docs)):
+            pipeline_terms = [token.text.lower() for token in pipeline_doc if not token.is_stop and not token.is_punct]
+            tokenizer_terms = self.__get_terms(tokenizer_doc)
+
+            if pipeline_terms != tokenizer_terms:
+                mismatches.append((position, pipeline_terms, tokenizer_terms))
+
+        return mismatches
@@ -5,13 +5,13 @@ from csearch.helpers.bm25_helper import BM25Helper
 
 class DatasetHelper:
     @classmethod
-    def __get_index_split(cls, dataset: dict, dataset_split: dict) -> dict:
+    def get_index_split(cls, dialog_times: list, dataset_split: dict) -> dict:
         """
         Given a train/dev/test distribution, this function returns the indexes of the chronological split. The
         resulting split can deviate from the proposed percentages in case the index falls between dialogs occuring
         at the same time
         NOTE: The dataset is assumed to be already ordered, as the previous processes take care of that
-        :param dataset
+        :param dialog_times: The dialog_time of each dialogue of the dataset, in order
         :param dataset_split: Should be a dict in the form
         {
             'train': 0.8,
@@ -20,16 +20,14 @@ class DatasetHelper:
         }
         :return:
         """
-        dataset_length = len(dataset)
+        dataset_length = len(dialog_times)
         dev_start_index = int(dataset_split['train'] * dataset_length)
 
-        while (dataset[dev_start_index]['dialog_time']
-               == dataset[dev_start_index + 1]['dialog_time']):
+        while dialog_times[dev_start_index] == dialog_times[dev_start_index + 1]:
             dev_start_index += 1
 
         test_start_index = dev_start_index + int(dataset_split['dev'] * dataset_length)
-        while (dataset[test_start_index]['dialog_time']
-               == dataset[test_start_index + 1]['dialog_time']):
+        while dialog_times[test_start_index] == dialog_times[test_start_index + 1]:
             test_start_index += 1
 
         return {
@@ -39,7 +37,15 @@ class DatasetHelper:
 
     @classmethod
     def get_split_dataset(cls, dataset: dict, dataset_split: dict) -> dict:
-        index_split = DatasetHelper.__get_index_split(dataset, dataset_split)
+        """
+        Splits a dataset chronologically
+        :param dataset: Dictionary index -> dialogue. The dialogues can either be dictionaries or JsonDialogue instances
+        :param dataset_split: See get_index_split
+        :return:
+        """
+        dialog_times = [entry['dialog_time'] if isinstance(entry, dict) else entry.dialog_time
+                        for entry in dataset.values()]
+        index_split = DatasetHelper.get_index_split(dialog_times, dataset_split)
         split_dataset = {
             'train': {},
             'dev': {},
@@ -114,40 +120,112 @@ class DatasetHelper:
         return corpus
 
     @classmethod
-    def __build_multi_topic_raw_agent_corpus(cls, json_data: dict) -> dict:
+    def __build_topic_document_indexes(cls, json_data: dict) -> dict:
         """
-        Builds the agent corpus, which is used to generate additional dialogues using BM25
-        :return:
+        Groups the documents of the agent corpus (see __build_raw_agent_corpus) by the topic of their dialogue
+        :return: Dictionary topic -> indexes of its documents in the agent corpus, in order
         """
-        corpus = {}
+        document_indexes = {}
+        current_index = 0
 
         for (key, dialogue) in json_data.items():
-            topic = dialogue['category']
-            if topic not in corpus:
-                corpus[topic] = []
+            documents_count = len(DatasetHelper.__process_agent_responses(dialogue))
+            document_indexes.setdefault(dialogue['category'], []).extend(
+                range(current_index, current_index + documents_count)
+            )
+            current_index += documents_count
 
-            corpus[topic] += (DatasetHelper.__process_agent_responses(dialogue))
+        return document_indexes
 
-        return corpus
+    @classmethod
+    def deduplicate_corpus(cls, corpus: list) -> tuple:
+        """
+        Removes the repeated documents of a corpus (e.g. boilerplate answers, or a web page cited several times)
+        :param corpus:
+        :return: Tuple (unique documents, in order of first occurrence, number of occurrences of each unique document,
+        position of each document of the corpus among the unique documents)
+        """
+        unique_positions = {}
+        unique_documents = []
+        multiplicities = []
+        document_positions = []
+
+        for document in corpus:
+            position = unique_positions.setdefault(document, len(unique_documents))
+            if position == len(unique_documents):
+                unique_documents.append(document)
+                multiplicities.append(0)
+
+            multiplicities[position] += 1
+            document_positions.append(position)
+
+        return unique_documents, multiplicities, document_positions
+
+    @classmethod
+    def build_corpus_bm25_helper(cls, corpus: list, index_folder: str = None, n_process: int = 1,
+                                 count_duplicates: bool = False) -> tuple:
+        """
+        Builds the bm25 helper of a corpus, which only indexes its unique documents
+        :param corpus:
+        :param index_folder: Where the BM25 index is persisted (see BM25Helper). Each value of count_duplicates has
+        its own sub-folder
+        :param n_process: Number of processes used to pre-process the corpus
+        :param count_duplicates: Compute the idf and the average document length over the corpus with its duplicates,
+        as when they were indexed, instead of over the unique documents
+        :return: Tuple (BM25Helper, position of each document of the corpus among the indexed ones)
+        """
+        documents, multiplicities, document_positions = DatasetHelper.deduplicate_corpus(corpus)
+        print('Indexing ' + str(len(documents)) + ' unique documents out of ' + str(len(corpus)))
+
+        if index_folder is not None:
+            index_folder += '/with_duplicates' if count_duplicates else '/deduplicated'
+
+        bm25_helper = BM25Helper(documents, index_folder=index_folder, n_process=n_process,
+                                 multiplicities=multiplicities if count_duplicates else None)
+
+        return bm25_helper, document_positions
 
     @classmethod
-    def build_bm25_helper(cls, json_data: dict) -> BM25Helper:
+    def build_bm25_helper(cls, json_data: dict, index_folder: str = None, n_process: int = 1,
+                          count_duplicates: bool = False) -> BM25Helper:
         """
         Build the bm25 helper, that will be used to perform negative sampling
+        :param json_data:
+        :param index_folder: Where the BM25 index is persisted (see build_corpus_bm25_helper)
+        :param n_process: Number of processes used to pre-process the corpus
+        :param count_duplicates: See build_corpus_bm25_helper
         :return:
         """
-        return BM25Helper(DatasetHelper.__build_raw_agent_corpus(json_data))
+        bm25_helper, _ = DatasetHelper.build_corpus_bm25_helper(
+            DatasetHelper.__build_raw_agent_corpus(json_data), index_folder, n_process, count_duplicates
+        )
+
+        return bm25_helper
 
     @classmethod
-    def build_multi_topic_bm25_helper(cls, json_data: dict) -> dict:
-        bm25_helper = {}
-        raw_agent_corpus = DatasetHelper.__build_multi_topic_raw_agent_corpus(json_data)
+    def build_multi_topic_bm25_helper(cls, json_data: dict, index_folder: str = None, n_process: int = 1,
+                                      count_duplicates: bool = False) -> dict:
+        """
+        Builds one bm25 helper per topic. The corpus is pre-processed (or loaded from index_folder) once, as a whole,
+        so that the per-topic helpers and the one of build_bm25_helper share the same index. The per-topic indexes
+        are then built concurrently
+        :param json_data:
+        :param index_folder: Where the BM25 index is persisted (see build_corpus_bm25_helper). The per-topic indexes
+        are persisted in a sub-folder per topic
+        :param n_process: Number of processes used to pre-process the corpus and to build the per-topic indexes
+        :param count_duplicates: See build_corpus_bm25_helper
+        :return: Dictionary topic -> BM25Helper
+        """
+        corpus_bm25_helper, document_positions = DatasetHelper.build_corpus_bm25_helper(
+            DatasetHelper.__build_raw_agent_corpus(json_data), index_folder, n_process, count_duplicates
+        )
 
-        for topic, entry in raw_agent_corpus.items():
-            print('Building BM25 corpus for topic: ' + topic)
-            bm25_helper[topic] = BM25Helper(entry)
+        topic_document_indexes = {
+            topic: [document_positions[index] for index in document_indexes]
+            for topic, document_indexes in DatasetHelper.__build_topic_document_indexes(json_data).items()
+        }
 
-        return bm25_helper
+        return corpus_bm25_helper.build_subset_helpers(topic_document_indexes, corpus_bm25_helper.index_folder)
 
     @classmethod
     def __process_agent_responses(cls, dialogue: dict) -> list:
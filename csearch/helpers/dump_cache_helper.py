@@ -0,0 +1,114 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from pyarrow import feather
+
+# Format used by the StackExchange dumps for every CreationDate attribute (always millisecond precision)
+DUMP_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class DumpCacheHelper:
+    """
+    Keeps a typed, columnar (Feather) copy of each parsed dump file next to the original XML. The cache is reused as
+    long as the size and modification time of the XML file, as well as the description of how it is parsed (columns,
+    types, filters), are the same as when it was written. Otherwise, the XML is parsed again and the cache is
+    overwritten.
+    """
+    CACHE_VERSION = 1
+
+    def __init__(self, folder: str):
+        self.__folder = folder
+
+    def __source_file(self, name: str) -> str:
+        return self.__folder + '/' + name + '.xml'
+
+    def __cache_file(self, name: str) -> str:
+        return self.__folder + '/' + name + '.feather'
+
+    def __build_signature(self, name: str, parse_options: dict) -> dict:
+        source_stat = os.stat(self.__source_file(name))
+        signature = {
+            'version': DumpCacheHelper.CACHE_VERSION,
+            'size': source_stat.st_size,
+            'mtime': source_stat.st_mtime_ns,
+            'parse_options': parse_options,
+        }
+
+        # Normalize it the way it is stored (e.g. tuples become lists), so that it compares equal to the stored one
+        return json.loads(json.dumps(signature))
+
+    def __read_signature(self, name: str):
+        try:
+            with open(self.__cache_file(name) + '.json', 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def apply_dtypes(cls, df: DataFrame, dtypes: dict) -> DataFrame:
+        """
+        Converts the raw (string) columns of a parsed dump file to their types
+        :param df:
+        :param dtypes: Dictionary column -> one of 'integer', 'datetime', 'category'
+        :return:
+        """
+        for column, dtype in dtypes.items():
+            if dtype == 'integer':
+                # Columns with missing values end up as float, exactly like the rest of the pipeline expects
+                df[column] = pd.to_numeric(df[column], downcast='integer')
+            elif dtype == 'datetime':
+                df[column] = pd.to_datetime(df[column], format=DUMP_DATE_FORMAT)
+            elif dtype == 'category':
+                df[column] = df[column].astype('category')
+            else:
+                raise ValueError('Unknown dump column type: ' + dtype)
+
+        return df
+
+    def __write(self, name: str, df: DataFrame, signature: dict) -> None:
+        cache_file = self.__cache_file(name)
+
+        # Uncompressed, so that later reads can memory-map the file instead of decoding it
+        feather.write_feather(df, cache_file + '.tmp', compression='uncompressed')
+        os.replace(cache_file + '.tmp', cache_file)
+
+        # The signature is written last: a cache without a matching signature is never read
+        with open(cache_file + '.json.tmp', 'w') as f:
+            json.dump(signature, f)
+        os.replace(cache_file + '.json.tmp', cache_file + '.json')
+
+    def load(self, name: str, parse_options: dict, parse) -> DataFrame:
+        """
+        Returns the typed DataFrame of a dump file, either from the cache or by parsing the XML
+        :param name: Name of the dump file, without extension (e.g. Posts)
+        :param parse_options: JSON-serializable description of how the file is parsed. The cache is only used if it
+        was written with the same options
+        :param parse: Callable returning the typed DataFrame, used when the cache cannot be
+        :return:
+        """
+        signature = self.__build_signature(name, parse_options)
+
+        if os.path.isfile(self.__cache_file(name)) and self.__read_signature(name) == signature:
+            print('Loading ' + name + ' from cache')
+            return feather.read_table(self.__cache_file(name), memory_map=True).to_pandas()
+
+        print('Parsing ' + name + '.xml')
+        df = parse()
+        self.__write(name, df, signature)
+
+        return df
+
+    @classmethod
+    def format_dates(cls, dates: pd.Series) -> pd.Series:
+        """
+        Converts a datetime column back to the textual representation used in the dumps. Missing dates stay NaN
+        :param dates:
+        :return:
+        """
+        values = dates.to_numpy(dtype='datetime64[ms]')
+        formatted = np.datetime_as_string(values, unit='ms').astype(object)
+        formatted[np.isnat(values)] = np.nan
+
+        return pd.Series(formatted, index=dates.index, name=dates.name)
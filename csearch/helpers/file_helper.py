@@ -1,8 +1,70 @@
+import io
 import csv
+import gzip
+import hashlib
+import os
+import shutil
+import numpy as np
 
 class FileHelper:
-    def __init__(self, file_location: str):
+    """
+    Writes the files of a dataset, named after a common location and a suffix each. Besides one-off writes
+    (write_tsv, write_array), files can be kept open for the whole generation of a dataset (see open): the rows are
+    encoded into an in-memory buffer, which is written to the file once it holds buffer_size bytes
+    """
+    # Bytes (of encoded text) accumulated for a file opened with open before they are written
+    WRITE_BUFFER_SIZE = 16 * 1024 * 1024
+    # Encoding of the files opened with open, which the training set readers decode
+    ENCODING = 'utf-8'
+    # Supported compressions, and the extension they add to the file names
+    COMPRESSION_EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+    # First bytes of the files of each compression
+    COMPRESSION_MAGIC_NUMBERS = {'gzip': b'\x1f\x8b', 'zstd': b'\x28\xb5\x2f\xfd'}
+
+    def __init__(self, file_location: str, compression: str = None, buffer_size: int = WRITE_BUFFER_SIZE):
+        """
+        :param file_location:
+        :param compression: None, 'gzip' or 'zstd' (requires the zstandard package). Applies to the tsv and text
+        files, whose names get the extension of the compression
+        :param buffer_size: See WRITE_BUFFER_SIZE
+        """
+        if compression not in FileHelper.COMPRESSION_EXTENSIONS:
+            raise ValueError('Unknown compression: ' + str(compression))
+
         self.__file_location = file_location
+        self.compression = compression
+        self.buffer_size = buffer_size
+        # Suffix -> (binary file, byte buffer, text wrapper of the buffer, tsv writer of the wrapper) for the files
+        # kept open
+        self.__outputs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __open_file(self, suffix: str, write_mode: str):
+        """
+        :param suffix:
+        :param write_mode: 'w' or 'a', in text mode, or with 'b' appended, in binary mode
+        :return:
+        """
+        file_name = self.get_output_name(suffix)
+        is_binary = write_mode.endswith('b')
+
+        if self.compression == 'gzip':
+            return gzip.open(file_name, write_mode if is_binary else write_mode + 't')
+
+        if self.compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError('The zstd compression requires the zstandard package (pip install zstandard)')
+
+            return zstandard.open(file_name, write_mode if is_binary else write_mode + 't')
+
+        return open(file_name, write_mode)
 
     def write_tsv(self, suffix: str, data: list, append: bool = False) -> None:
         """
@@ -12,13 +74,224 @@ class FileHelper:
         :return:
         """
         write_mode = 'a' if append else 'w'
-        with open(self.__file_location + suffix, write_mode) as tsv_file:
+        with self.__open_file(suffix, write_mode) as tsv_file:
             writer = csv.writer(tsv_file, delimiter='\t', lineterminator='\n')
             for entry in data:
                 writer.writerow(entry)
 
     def write_array(self, suffix: str, data: list, append: bool = False) -> None:
         write_mode = 'a' if append else 'w'
-        with open(self.__file_location + suffix, write_mode) as f:
+        with self.__open_file(suffix, write_mode) as f:
             for entry in data:
                 f.write('%s\n' % entry)
+
+    def open(self, suffix: str, append: bool = False) -> None:
+        """
+        Opens a file for write_rows and write_lines. It stays open until close is called. The text is encoded as it is
+        buffered, so that the size of the buffer is counted in bytes and the file is written in binary mode
+        :param suffix:
+        :param append: Append to the file instead of emptying it
+        :return:
+        """
+        buffer = io.BytesIO()
+        text_buffer = io.TextIOWrapper(buffer, encoding=FileHelper.ENCODING, newline='', write_through=True)
+        writer = csv.writer(text_buffer, delimiter='\t', lineterminator='\n')
+        self.__outputs[suffix] = (self.__open_file(suffix, 'ab' if append else 'wb'), buffer, text_buffer, writer)
+
+    def write_rows(self, suffix: str, rows: list) -> None:
+        """
+        Writes rows in tsv format to a file opened with open
+        :param suffix:
+        :param rows:
+        :return:
+        """
+        _, buffer, _, writer = self.__outputs[suffix]
+        writer.writerows(rows)
+
+        if buffer.tell() >= self.buffer_size:
+            self.__write_buffer(suffix)
+
+    def write_lines(self, suffix: str, entries: list) -> None:
+        """
+        Writes each entry on its own line to a file opened with open
+        :param suffix:
+        :param entries:
+        :return:
+        """
+        _, buffer, text_buffer, _ = self.__outputs[suffix]
+        for entry in entries:
+            text_buffer.write('%s\n' % entry)
+
+        if buffer.tell() >= self.buffer_size:
+            self.__write_buffer(suffix)
+
+    def __write_buffer(self, suffix: str) -> None:
+        output_file, buffer, _, _ = self.__outputs[suffix]
+
+        output_file.write(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+
+    def flush(self) -> None:
+        """
+        Writes the buffered content of the open files
+        :return:
+        """
+        for suffix, (output_file, _, _, _) in self.__outputs.items():
+            self.__write_buffer(suffix)
+            output_file.flush()
+
+    def close(self) -> None:
+        """
+        Writes the buffered content of the open files and closes them
+        :return:
+        """
+        for suffix, (output_file, _, text_buffer, _) in self.__outputs.items():
+            self.__write_buffer(suffix)
+            output_file.close()
+            text_buffer.close()
+
+        self.__outputs = {}
+
+    def get_file_name(self, suffix: str) -> str:
+        return self.__file_location + suffix
+
+    def get_output_name(self, suffix: str) -> str:
+        """
+        Returns the name of a file written by this helper, with the extension of the compression
+        :param suffix:
+        :return:
+        """
+        return self.__file_location + suffix + FileHelper.COMPRESSION_EXTENSIONS[self.compression]
+
+    def clear(self, suffix: str) -> None:
+        """
+        Creates an empty file, or empties an existing one
+        :param suffix:
+        :return:
+        """
+        open(self.get_output_name(suffix), 'w').close()
+
+    def remove(self, suffix: str) -> None:
+        """
+        Deletes a file, if it exists
+        :param suffix:
+        :return:
+        """
+        if os.path.isfile(self.get_output_name(suffix)):
+            os.remove(self.get_output_name(suffix))
+
+    def get_size(self, suffix: str) -> int:
+        return os.path.getsize(self.get_output_name(suffix))
+
+    def has_size(self, suffix: str, size: int) -> bool:
+        """
+        Checks that a file exists and holds at least size bytes (e.g. the size it had at a checkpoint)
+        :param suffix:
+        :param size:
+        :return:
+        """
+        return os.path.isfile(self.get_output_name(suffix)) and self.get_size(suffix) >= size
+
+    def truncate(self, suffix: str, size: int) -> None:
+        """
+        Cuts a file to its first size bytes (e.g. the size it had at a checkpoint). The file is created if it does not
+        exist and size is 0
+        :param suffix:
+        :param size:
+        :return:
+        """
+        if size > 0 and not self.has_size(suffix, size):
+            raise ValueError('Cannot truncate ' + self.get_output_name(suffix) + ' to ' + str(size) + ' bytes: the '
+                             'file is shorter')
+
+        with open(self.get_output_name(suffix), 'ab') as f:
+            f.truncate(size)
+
+    def sync(self, suffix: str) -> None:
+        """
+        Forces a file, once closed, to be written to the disk (fsync), so that its content survives a system crash
+        :param suffix:
+        :return:
+        """
+        with open(self.get_output_name(suffix), 'ab') as f:
+            os.fsync(f.fileno())
+
+    def get_shard_helper(self, shard_index: int):
+        """
+        Returns a helper for the files of a shard of the data, written separately and then appended to the files of
+        this helper (see append_file)
+        :param shard_index:
+        :return:
+        """
+        return FileHelper(self.__file_location + '_shard' + str(shard_index), self.compression, self.buffer_size)
+
+    def append_file(self, suffix: str, file_helper) -> None:
+        """
+        Appends the content of a file of another helper (e.g. a shard) to the file with the same suffix, then deletes
+        it. Compressed files can be appended as well: the result is a multi-member gzip file (or multi-frame zstd
+        file), which decompresses to the concatenation of the content of both files
+        :param suffix:
+        :param file_helper:
+        :return:
+        """
+        source_file = file_helper.get_output_name(suffix)
+
+        with open(self.get_output_name(suffix), 'ab') as destination, open(source_file, 'rb') as source:
+            shutil.copyfileobj(source, destination, 1024 * 1024)
+
+        os.remove(source_file)
+
+    @classmethod
+    def get_compression(cls, file_name: str):
+        """
+        Detects the compression of a file, from its extension or, failing that, from its first bytes
+        :param file_name:
+        :return: 'gzip', 'zstd', or None for an uncompressed file
+        """
+        for compression, extension in FileHelper.COMPRESSION_EXTENSIONS.items():
+            if compression is not None and file_name.endswith(extension):
+                return compression
+
+        with open(file_name, 'rb') as f:
+            header = f.read(max(len(magic_number) for magic_number in FileHelper.COMPRESSION_MAGIC_NUMBERS.values()))
+
+        for compression, magic_number in FileHelper.COMPRESSION_MAGIC_NUMBERS.items():
+            if header.startswith(magic_number):
+                return compression
+
+        return None
+
+    @classmethod
+    def memory_map(cls, file_name: str, dtype) -> np.ndarray:
+        """
+        Memory-maps a binary file as a read-only array
+        :param file_name:
+        :param dtype:
+        :return:
+        """
+        # Empty files cannot be memory-mapped
+        if os.path.getsize(file_name) == 0:
+            return np.zeros(0, dtype=dtype)
+
+        return np.memmap(file_name, dtype=dtype, mode='r')
+
+    @classmethod
+    def get_files_hash(cls, file_names: list) -> str:
+        """
+        Computes a hash of the content of the given files, which identifies data derived from them (e.g. a BM25 index)
+        :param file_names:
+        :return: Hexadecimal SHA-1 digest
+        """
+        digest = hashlib.sha1()
+
+        # Hashing the digest of each file (rather than their concatenation) keeps the boundaries between files
+        for file_name in file_names:
+            file_digest = hashlib.sha1()
+            with open(file_name, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    file_digest.update(block)
+
+            digest.update(file_digest.digest())
+
+        return digest.hexdigest()
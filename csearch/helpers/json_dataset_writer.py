@@ -0,0 +1,76 @@
+import json
+from array import array
+
+
+class JsonDatasetWriter:
+    """
+    Writes a JSON dataset (a dictionary index -> dialogue) one dialogue at a time. The resulting file is byte for byte
+    what json.dump produces for the whole dictionary, but only the dialogue being written is held in memory.
+    The byte range of each dialogue is recorded, so that any contiguous range of dialogues (e.g. a chronological
+    split) can later be copied into its own JSON file without parsing the dataset again.
+    """
+    COPY_BUFFER_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.__file = open(file_name, 'wb')
+        self.__file.write(b'{')
+        self.__position = 1
+        self.__starts = array('q')
+        self.__ends = array('q')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.__starts)
+
+    def write(self, dialogue: dict) -> None:
+        """
+        Appends a dialogue to the dataset. Its index is the number of dialogues written before it
+        :param dialogue:
+        :return:
+        """
+        index = len(self.__starts)
+        if index > 0:
+            self.__file.write(b', ')
+            self.__position += 2
+
+        entry = (json.dumps(str(index)) + ': ' + json.dumps(dialogue)).encode('utf-8')
+        self.__file.write(entry)
+
+        self.__starts.append(self.__position)
+        self.__position += len(entry)
+        self.__ends.append(self.__position)
+
+    def close(self) -> None:
+        if not self.__file.closed:
+            self.__file.write(b'}')
+            self.__file.close()
+
+    def copy_range(self, file_name: str, start_index: int, end_index: int) -> None:
+        """
+        Writes the dialogues start_index (included) to end_index (excluded) into a new JSON file, keeping their
+        indexes. Can only be called once the dataset is closed
+        :param file_name:
+        :param start_index:
+        :param end_index:
+        :return:
+        """
+        with open(file_name, 'wb') as output_file:
+            output_file.write(b'{')
+
+            if start_index < end_index:
+                with open(self.file_name, 'rb') as dataset_file:
+                    dataset_file.seek(self.__starts[start_index])
+                    remaining_bytes = self.__ends[end_index - 1] - self.__starts[start_index]
+
+                    while remaining_bytes > 0:
+                        chunk = dataset_file.read(min(remaining_bytes, JsonDatasetWriter.COPY_BUFFER_SIZE))
+                        output_file.write(chunk)
+                        remaining_bytes -= len(chunk)
+
+            output_file.write(b'}')
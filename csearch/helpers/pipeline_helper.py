@@ -0,0 +1,80 @@
+import queue
+import threading
+
+
+class PipelineHelper:
+    """
+    Runs the stages of a pipeline of generators concurrently. A buffered stage is iterated in a thread of its own and
+    hands its items to the next stage through a bounded queue, so that the stages overlap while the number of items in
+    flight between them stays constant
+    """
+    # Interval (in seconds) at which a stage blocked on a full queue checks whether the next stage stopped
+    POLL_INTERVAL = 0.1
+
+    @classmethod
+    def __put(cls, items_queue: queue.Queue, entry: tuple, stopped: threading.Event) -> bool:
+        """
+        Waits for room in the queue, unless the consumer stopped
+        :param items_queue:
+        :param entry:
+        :param stopped:
+        :return: Whether the entry was queued
+        """
+        while not stopped.is_set():
+            try:
+                items_queue.put(entry, timeout=PipelineHelper.POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    @classmethod
+    def __produce(cls, items, items_queue: queue.Queue, stopped: threading.Event) -> None:
+        """
+        Thread of a buffered stage. Each entry of the queue is a pair (True, item), then (False, None) at the end of
+        the items, or (False, exception) if the stage failed
+        :param items:
+        :param items_queue:
+        :param stopped:
+        :return:
+        """
+        try:
+            for item in items:
+                if not PipelineHelper.__put(items_queue, (True, item), stopped):
+                    return
+        except BaseException as error:
+            PipelineHelper.__put(items_queue, (False, error), stopped)
+            return
+
+        PipelineHelper.__put(items_queue, (False, None), stopped)
+
+    @classmethod
+    def buffer(cls, items, max_size: int):
+        """
+        Iterates items (usually a generator stage) in a background thread, at most max_size items ahead of the
+        consumer. The items keep their order, and an exception raised by the stage is raised again to the consumer.
+        Once the returned generator is closed (e.g. with contextlib.closing), the thread is stopped and joined, so the
+        objects used by the stage can be used again
+        :param items:
+        :param max_size:
+        :return: Generator of the items
+        """
+        items_queue = queue.Queue(maxsize=max_size)
+        stopped = threading.Event()
+        thread = threading.Thread(target=PipelineHelper.__produce, args=(items, items_queue, stopped), daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                is_item, value = items_queue.get()
+
+                if not is_item:
+                    if value is not None:
+                        raise value
+                    return
+
+                yield value
+        finally:
+            stopped.set()
+            thread.join()
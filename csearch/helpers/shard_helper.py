@@ -0,0 +1,25 @@
+from math import ceil
+
+
+class ShardHelper:
+    """
+    Splits the work of the parallel modes (see Pandas2JSON and JSON2Training) into shards for a pool of workers
+    """
+    # Number of shards handed to each worker in parallel mode (smaller shards balance the load better)
+    SHARDS_PER_WORKER = 4
+
+    @classmethod
+    def get_shard_ranges(cls, start: int, end: int, num_workers: int, block_size: int = 1) -> list:
+        """
+        Splits the items start to end in contiguous (start, end) ranges, about SHARDS_PER_WORKER per worker
+        :param start:
+        :param end:
+        :param num_workers:
+        :param block_size: The shards are made of whole blocks of block_size items (except for the last one)
+        :return:
+        """
+        blocks_count = ceil((end - start) / block_size)
+        shard_blocks = max(1, ceil(blocks_count / (num_workers * ShardHelper.SHARDS_PER_WORKER)))
+        shard_size = shard_blocks * block_size
+
+        return [(shard_start, min(shard_start + shard_size, end)) for shard_start in range(start, end, shard_size)]
@@ -0,0 +1,51 @@
+import re
+import hashlib
+
+# Matches every HTML tag, except links, line breaks, quotes and code, as well as newlines and tabs. Both are
+# removed in a single pass over the text
+CLEAN_TEXT_PATTERN = re.compile(
+    '<(?!a)(?!br)(?!blockquote)(?!pre)(?!code)(?!/blockquote)(?!/pre)(?!/code).*?>|[\n\r\t]'
+)
+
+URL_PATTERN = re.compile('http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\), ]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+
+# Line breaks inside crawled documents are turned into sentence separators
+DOCUMENT_LINE_BREAKS = str.maketrans({'\n': '.', '\r': '.'})
+
+
+class TextHelper:
+    @classmethod
+    def strip_html(cls, text: str) -> str:
+        """
+        Strips all the HTML tags (except links, quotes, code) and removes all the newlines and tabs
+        :param text:
+        :return:
+        """
+        return CLEAN_TEXT_PATTERN.sub('', text)
+
+    @classmethod
+    def is_grounded(cls, text: str) -> bool:
+        """
+        Checks whether a text contains a link. Stops at the first URL found
+        :param text:
+        :return:
+        """
+        return 'href' in text or URL_PATTERN.search(text) is not None
+
+    @classmethod
+    def flatten_document(cls, text: str) -> str:
+        """
+        Replaces the line breaks of a web document with dots, so that the document fits in a single tsv cell
+        :param text:
+        :return:
+        """
+        return text.translate(DOCUMENT_LINE_BREAKS)
+
+    @classmethod
+    def get_text_hash(cls, text: str) -> bytes:
+        """
+        Returns a short digest identifying a text, which can be kept instead of (long) texts as a dictionary key
+        :param text:
+        :return:
+        """
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
@@ -0,0 +1,336 @@
+import os
+import json
+import numpy as np
+from csearch.helpers.file_helper import FileHelper
+
+# Version of the format written by TrainingSetWriter. Stores written with another version are not read
+STORE_FORMAT_VERSION = 1
+
+STRING_OFFSET_DTYPE = np.dtype('<i8')
+STRING_ID_DTYPE = np.dtype('<i4')
+RECORD_DTYPE = np.dtype([('dialogue_id', '<i8'), ('context_end', '<i8'), ('candidates_end', '<i8')])
+
+
+class TrainingSetWriter:
+    """
+    Writes a training set in a compact binary form. Every distinct utterance or document is stored once, and each
+    context is a record holding the IDs of its utterances and of its candidate responses (the true response first,
+    then the negative ones), instead of one tsv row per candidate repeating the whole context.
+    The store is made of the following files (file location + suffix):
+    - _strings.bin: the UTF-8 texts, one after the other. The string ID of a text is its position
+    - _string_offsets.bin: the end offset of each text in _strings.bin
+    - _contexts.bin: the string IDs of the context utterances of all the records, one record after the other
+    - _candidates.bin: the string IDs of the candidate responses of all the records, one record after the other
+    - _records.bin: for each record, the dialogue ID (as in the lookup file) and the end of its utterances and
+    candidates in the two previous files
+    - _store.json: the version and the counts, written when the writer is closed
+    The tsv rows are rebuilt on demand by TrainingSetReader
+    """
+    FILE_SUFFIXES = ['_strings.bin', '_string_offsets.bin', '_contexts.bin', '_candidates.bin', '_records.bin']
+    METADATA_SUFFIX = '_store.json'
+
+    def __init__(self, file_location: str, state: dict = None):
+        """
+        :param file_location:
+        :param state: Continue a store from a state returned by get_state (e.g. recorded in a checkpoint): the files
+        are truncated to that state and the following records are appended. Otherwise, the store is written anew
+        """
+        self.file_location = file_location
+
+        # A store without metadata is incomplete and is never read
+        if os.path.isfile(file_location + TrainingSetWriter.METADATA_SUFFIX):
+            os.remove(file_location + TrainingSetWriter.METADATA_SUFFIX)
+
+        if state is None:
+            state = {'strings_count': 0, 'strings_size': 0, 'contexts_count': 0, 'candidates_count': 0,
+                     'records_count': 0}
+            self.__files = {suffix: open(file_location + suffix, 'wb') for suffix in TrainingSetWriter.FILE_SUFFIXES}
+        else:
+            if not TrainingSetWriter.has_state(file_location, state):
+                raise ValueError('The files of ' + file_location + ' are shorter than the state to continue from')
+
+            self.__files = {}
+            for suffix, size in TrainingSetWriter.__get_file_sizes(state).items():
+                self.__files[suffix] = open(file_location + suffix, 'ab')
+                self.__files[suffix].truncate(size)
+
+        # Text -> string ID. Python caches the hash of a str, so looking up the same objects again (e.g. the documents
+        # of the BM25 corpus, sampled over and over) does not hash the whole text every time
+        self.__string_ids = self.__read_string_ids(state['strings_count'])
+        self.__strings_size = state['strings_size']
+        self.__contexts_count = state['contexts_count']
+        self.__candidates_count = state['candidates_count']
+        self.__records_count = state['records_count']
+
+        # Entries not written yet (see flush)
+        self.__string_offsets = []
+        self.__contexts = []
+        self.__candidates = []
+        self.__records = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.__records_count
+
+    @classmethod
+    def __get_file_sizes(cls, state: dict) -> dict:
+        return {
+            '_strings.bin': state['strings_size'],
+            '_string_offsets.bin': state['strings_count'] * STRING_OFFSET_DTYPE.itemsize,
+            '_contexts.bin': state['contexts_count'] * STRING_ID_DTYPE.itemsize,
+            '_candidates.bin': state['candidates_count'] * STRING_ID_DTYPE.itemsize,
+            '_records.bin': state['records_count'] * RECORD_DTYPE.itemsize,
+        }
+
+    @classmethod
+    def has_state(cls, file_location: str, state: dict) -> bool:
+        """
+        Checks that the files of a store can be continued from a state: they must all exist and hold at least the
+        entries counted in the state
+        :param file_location:
+        :param state: As returned by get_state
+        :return:
+        """
+        return all(
+            os.path.isfile(file_location + suffix) and os.path.getsize(file_location + suffix) >= size
+            for suffix, size in TrainingSetWriter.__get_file_sizes(state).items()
+        )
+
+    def __read_string_ids(self, strings_count: int) -> dict:
+        """
+        Reads back the strings already in the store, when it is continued
+        :param strings_count:
+        :return:
+        """
+        if strings_count == 0:
+            return {}
+
+        string_offsets = np.fromfile(self.file_location + '_string_offsets.bin', dtype=STRING_OFFSET_DTYPE,
+                                     count=strings_count).tolist()
+        with open(self.file_location + '_strings.bin', 'rb') as f:
+            strings = f.read(string_offsets[-1])
+
+        starts = [0] + string_offsets[:-1]
+
+        return {strings[start:end].decode('utf-8'): string_id
+                for string_id, (start, end) in enumerate(zip(starts, string_offsets))}
+
+    def __get_string_id(self, text: str) -> int:
+        string_id = self.__string_ids.get(text)
+
+        if string_id is None:
+            string_id = len(self.__string_ids)
+            self.__string_ids[text] = string_id
+
+            encoded_text = text.encode('utf-8')
+            self.__files['_strings.bin'].write(encoded_text)
+            self.__strings_size += len(encoded_text)
+            self.__string_offsets.append(self.__strings_size)
+
+        return string_id
+
+    def write_context(self, dialogue_id: int, context: list, true_response: str, negative_responses: list) -> None:
+        """
+        Appends the record of a context
+        :param dialogue_id: ID of the dialogue of the context, as written in the lookup file
+        :param context: The utterances of the context, in order
+        :param true_response:
+        :param negative_responses:
+        :return:
+        """
+        self.__contexts += [self.__get_string_id(utterance) for utterance in context]
+        self.__candidates.append(self.__get_string_id(true_response))
+        self.__candidates += [self.__get_string_id(response) for response in negative_responses]
+
+        self.__contexts_count += len(context)
+        self.__candidates_count += 1 + len(negative_responses)
+        self.__records_count += 1
+        self.__records.append((dialogue_id, self.__contexts_count, self.__candidates_count))
+
+    def flush(self) -> None:
+        """
+        Writes the pending entries to the files
+        :return:
+        """
+        self.__files['_string_offsets.bin'].write(np.array(self.__string_offsets, dtype=STRING_OFFSET_DTYPE).tobytes())
+        self.__files['_contexts.bin'].write(np.array(self.__contexts, dtype=STRING_ID_DTYPE).tobytes())
+        self.__files['_candidates.bin'].write(np.array(self.__candidates, dtype=STRING_ID_DTYPE).tobytes())
+        self.__files['_records.bin'].write(np.array(self.__records, dtype=RECORD_DTYPE).tobytes())
+
+        self.__string_offsets = []
+        self.__contexts = []
+        self.__candidates = []
+        self.__records = []
+
+    def get_state(self) -> dict:
+        """
+        Writes the pending entries and returns the counts of the store, from which it can be continued (see __init__)
+        :return:
+        """
+        self.flush()
+        for f in self.__files.values():
+            f.flush()
+
+        return {
+            'strings_count': len(self.__string_ids),
+            'strings_size': self.__strings_size,
+            'contexts_count': self.__contexts_count,
+            'candidates_count': self.__candidates_count,
+            'records_count': self.__records_count,
+        }
+
+    def sync(self) -> None:
+        """
+        Writes the pending entries and forces the files to be written to the disk (fsync), so that the state returned
+        by get_state survives a system crash
+        :return:
+        """
+        self.flush()
+        for f in self.__files.values():
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append_file(self, file_location: str) -> None:
+        """
+        Appends the records of a store written by another writer (e.g. a shard), then deletes it. Its strings are
+        added in order, so the result is the same as if its records had been written by this writer
+        :param file_location:
+        :return:
+        """
+        self.flush()
+        reader = TrainingSetReader(file_location)
+
+        string_ids = np.array(
+            [self.__get_string_id(reader.get_string(string_id)) for string_id in range(reader.strings_count)],
+            dtype=STRING_ID_DTYPE
+        )
+        self.flush()
+
+        records = np.array(reader.records)
+        records['context_end'] += self.__contexts_count
+        records['candidates_end'] += self.__candidates_count
+
+        self.__files['_contexts.bin'].write(string_ids[reader.contexts].tobytes())
+        self.__files['_candidates.bin'].write(string_ids[reader.candidates].tobytes())
+        self.__files['_records.bin'].write(records.tobytes())
+
+        self.__contexts_count += len(reader.contexts)
+        self.__candidates_count += len(reader.candidates)
+        self.__records_count += len(reader)
+
+        del reader
+        for suffix in TrainingSetWriter.FILE_SUFFIXES + [TrainingSetWriter.METADATA_SUFFIX]:
+            os.remove(file_location + suffix)
+
+    def close(self) -> None:
+        if self.__files['_records.bin'].closed:
+            return
+
+        metadata = {'version': STORE_FORMAT_VERSION, **self.get_state()}
+        for f in self.__files.values():
+            f.close()
+
+        metadata_file = self.file_location + TrainingSetWriter.METADATA_SUFFIX
+        with open(metadata_file + '.tmp', 'w') as f:
+            json.dump(metadata, f)
+        os.replace(metadata_file + '.tmp', metadata_file)
+
+
+class TrainingSetReader:
+    """
+    Reads a training set written by TrainingSetWriter. The files are memory-mapped, and the tsv rows of a record are
+    only rebuilt when they are requested
+    """
+    # Number of records expanded at once by write_tsv
+    WRITE_BLOCK_SIZE = 1000
+
+    def __init__(self, file_location: str):
+        try:
+            with open(file_location + TrainingSetWriter.METADATA_SUFFIX, 'r') as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            metadata = None
+
+        if metadata is None or metadata.get('version') != STORE_FORMAT_VERSION:
+            raise ValueError('No training set store found in ' + file_location)
+
+        self.file_location = file_location
+        self.strings_count = metadata['strings_count']
+        self.strings = FileHelper.memory_map(file_location + '_strings.bin', np.uint8)
+        self.string_offsets = FileHelper.memory_map(file_location + '_string_offsets.bin', STRING_OFFSET_DTYPE)
+        self.contexts = FileHelper.memory_map(file_location + '_contexts.bin', STRING_ID_DTYPE)
+        self.candidates = FileHelper.memory_map(file_location + '_candidates.bin', STRING_ID_DTYPE)
+        self.records = FileHelper.memory_map(file_location + '_records.bin', RECORD_DTYPE)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def get_string(self, string_id: int) -> str:
+        start = int(self.string_offsets[string_id - 1]) if string_id > 0 else 0
+        end = int(self.string_offsets[string_id])
+
+        return self.strings[start:end].tobytes().decode('utf-8')
+
+    def get_record(self, index: int) -> tuple:
+        """
+        Returns a record, with its texts
+        :param index:
+        :return: Tuple (dialogue ID, utterances of the context, candidate responses: the true one, then the negatives)
+        """
+        context_start = int(self.records[index - 1]['context_end']) if index > 0 else 0
+        candidates_start = int(self.records[index - 1]['candidates_end']) if index > 0 else 0
+        dialogue_id, context_end, candidates_end = self.records[index].tolist()
+
+        context = [self.get_string(string_id) for string_id in self.contexts[context_start:context_end].tolist()]
+        candidates = [
+            self.get_string(string_id) for string_id in self.candidates[candidates_start:candidates_end].tolist()
+        ]
+
+        return dialogue_id, context, candidates
+
+    def get_rows(self, index: int) -> list:
+        """
+        Returns the tsv rows (label, context utterances, response) of a record, as written by JSON2Training
+        :param index:
+        :return:
+        """
+        dialogue_id, context, candidates = self.get_record(index)
+
+        return [[1] + context + [candidates[0]]] + [[0] + context + [response] for response in candidates[1:]]
+
+    def iter_rows(self):
+        """
+        Generates the (dialogue ID, tsv row) pairs of all the records, in order
+        :return:
+        """
+        for index in range(len(self)):
+            dialogue_id = int(self.records[index]['dialogue_id'])
+
+            for row in self.get_rows(index):
+                yield dialogue_id, row
+
+    def write_tsv(self, file_helper: FileHelper) -> None:
+        """
+        Expands the store into the tsv and lookup files JSON2Training writes in the tsv format
+        :param file_helper:
+        :return:
+        """
+        file_helper.clear('.tsv')
+        file_helper.clear('_lookup.txt')
+
+        for block_start in range(0, len(self), TrainingSetReader.WRITE_BLOCK_SIZE):
+            rows = []
+            dialog_lookup_table = []
+
+            for index in range(block_start, min(len(self), block_start + TrainingSetReader.WRITE_BLOCK_SIZE)):
+                record_rows = self.get_rows(index)
+                rows += record_rows
+                dialog_lookup_table += [int(self.records[index]['dialogue_id'])] * len(record_rows)
+
+            file_helper.write_tsv('.tsv', rows, append=True)
+            file_helper.write_array('_lookup.txt', dialog_lookup_table, append=True)
@@ -0,0 +1,208 @@
+import os
+import csv
+import json
+import numpy as np
+from csearch.helpers.file_helper import FileHelper
+
+# Version of the sidecar index written by TrainingSetTsvReader. Indexes written with another version are rebuilt
+TSV_INDEX_VERSION = 1
+
+
+class TrainingSetTsvReader:
+    """
+    Random access to a training set tsv (and its lookup file) written by JSON2Training, without loading it.
+    The first time a file is read, a sidecar index is built next to it (in file_name + '.index'): the byte offset of
+    each row, the first row of each context and the dialogue ID of each row. The index is rebuilt whenever the size or
+    modification time of the files change. The tsv and the index are then memory-mapped, so that a row, the rows of a
+    context or the rows of a dialogue are read in constant time, whatever the size of the file.
+    Each row is a single line, as the utterances and documents do not contain line breaks (see TextHelper). A context
+    is a positive row (label 1) followed by its negative rows
+    """
+    # Size of the blocks of the tsv scanned at once when building the index
+    SCAN_BLOCK_SIZE = 64 * 1024 * 1024
+    # Number of dialogue IDs read at once by iter_dialogue_ids
+    ITER_BLOCK_SIZE = 1024 * 1024
+    # Arrays of the sidecar index
+    ARRAY_NAMES = ['row_offsets', 'context_starts', 'row_dialogue_ids']
+
+    def __init__(self, file_name: str, lookup_file_name: str = None):
+        """
+        :param file_name: The tsv file. It must not be compressed: the rows are read from the memory-mapped file
+        :param lookup_file_name: The lookup file of the tsv. By default, the file with the same name ending in
+        _lookup.txt instead of .tsv, if it exists. Without it, the rows cannot be accessed by dialogue
+        """
+        if lookup_file_name is None and file_name.endswith('.tsv'):
+            lookup_file_name = file_name[:-len('.tsv')] + '_lookup.txt'
+
+        self.file_name = file_name
+        self.lookup_file_name = lookup_file_name if lookup_file_name and os.path.isfile(lookup_file_name) else None
+        self.index_folder = file_name + '.index'
+
+        for name in [self.file_name, self.lookup_file_name]:
+            compression = None if name is None else FileHelper.get_compression(name)
+            if compression is not None:
+                raise ValueError(name + ' is compressed (' + compression + '). TrainingSetTsvReader only reads '
+                                 'uncompressed training sets: decompress it, or build the training set without '
+                                 'compression')
+
+        signature = self.__build_signature()
+        if self.__read_signature() != signature:
+            print('Indexing ' + file_name)
+            self.__build_index(signature)
+
+        for name in TrainingSetTsvReader.ARRAY_NAMES:
+            setattr(self, name, np.load(self.index_folder + '/' + name + '.npy', mmap_mode='r'))
+
+        self.__data = FileHelper.memory_map(file_name, np.uint8)
+        # Dialogue ID -> list of (first row, end row) ranges, built the first time it is needed
+        self.__dialogue_ranges = None
+
+    def __build_signature(self) -> dict:
+        signature = {'version': TSV_INDEX_VERSION}
+
+        for name, file_name in [('tsv', self.file_name), ('lookup', self.lookup_file_name)]:
+            if file_name is not None:
+                file_stat = os.stat(file_name)
+                signature[name] = {'file': os.path.abspath(file_name), 'size': file_stat.st_size,
+                                   'mtime': file_stat.st_mtime_ns}
+
+        return signature
+
+    def __read_signature(self):
+        try:
+            with open(self.index_folder + '/signature.json', 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def __build_index(self, signature: dict) -> None:
+        data = FileHelper.memory_map(self.file_name, np.uint8)
+
+        line_ends = [
+            np.flatnonzero(data[start:start + TrainingSetTsvReader.SCAN_BLOCK_SIZE] == ord('\n')) + start + 1
+            for start in range(0, len(data), TrainingSetTsvReader.SCAN_BLOCK_SIZE)
+        ]
+        row_ends = np.concatenate(line_ends) if line_ends else np.zeros(0, dtype=np.int64)
+        # The last row may not end with a line break
+        if len(data) > 0 and data[-1] != ord('\n'):
+            row_ends = np.append(row_ends, len(data))
+
+        row_offsets = np.concatenate(([0], row_ends)).astype(np.int64)
+        context_starts = np.flatnonzero(data[row_offsets[:-1]] == ord('1')).astype(np.int64)
+
+        if self.lookup_file_name is not None:
+            row_dialogue_ids = np.fromfile(self.lookup_file_name, dtype=np.int64, sep=' ')
+
+            if len(row_dialogue_ids) != len(row_offsets) - 1:
+                raise ValueError('The lookup file ' + self.lookup_file_name + ' does not match ' + self.file_name)
+        else:
+            row_dialogue_ids = np.zeros(0, dtype=np.int64)
+
+        os.makedirs(self.index_folder, exist_ok=True)
+        np.save(self.index_folder + '/row_offsets.npy', row_offsets)
+        np.save(self.index_folder + '/context_starts.npy', context_starts)
+        np.save(self.index_folder + '/row_dialogue_ids.npy', row_dialogue_ids)
+
+        # The signature is written last: an index without a matching signature is never read
+        with open(self.index_folder + '/signature.json.tmp', 'w') as f:
+            json.dump(signature, f)
+        os.replace(self.index_folder + '/signature.json.tmp', self.index_folder + '/signature.json')
+
+    def __len__(self) -> int:
+        return len(self.row_offsets) - 1
+
+    def get_row(self, index: int) -> list:
+        """
+        Returns a row, split in its fields (label, context utterances, response), all of them as strings
+        :param index:
+        :return:
+        """
+        line = self.__data[self.row_offsets[index]:self.row_offsets[index + 1]].tobytes().decode('utf-8')
+
+        return next(csv.reader([line.rstrip('\n')], delimiter='\t'))
+
+    def get_rows(self, start: int, end: int) -> list:
+        """
+        Returns the rows start (included) to end (excluded)
+        :param start:
+        :param end:
+        :return:
+        """
+        return [self.get_row(index) for index in range(start, end)]
+
+    def get_contexts_count(self) -> int:
+        return len(self.context_starts)
+
+    def get_context_range(self, index: int) -> tuple:
+        """
+        Returns the rows of a context, as a (first row, end row) range
+        :param index: Position of the context in the file
+        :return:
+        """
+        end = int(self.context_starts[index + 1]) if index + 1 < len(self.context_starts) else len(self)
+
+        return int(self.context_starts[index]), end
+
+    def get_context(self, index: int, max_rows: int = None) -> list:
+        """
+        Returns the rows of a context: the positive one first, then the negative ones
+        :param index: Position of the context in the file
+        :param max_rows: Only return the first max_rows rows
+        :return:
+        """
+        start, end = self.get_context_range(index)
+        if max_rows is not None:
+            end = min(end, start + max_rows)
+
+        return self.get_rows(start, end)
+
+    def get_dialogue_id(self, index: int) -> int:
+        """
+        Returns the ID of the dialogue a row was generated from (its line in the lookup file)
+        :param index:
+        :return:
+        """
+        return int(self.row_dialogue_ids[index])
+
+    def iter_dialogue_ids(self):
+        """
+        Generates the dialogue ID of each row, in order, without loading the whole lookup file
+        :return:
+        """
+        for start in range(0, len(self.row_dialogue_ids), TrainingSetTsvReader.ITER_BLOCK_SIZE):
+            yield from self.row_dialogue_ids[start:start + TrainingSetTsvReader.ITER_BLOCK_SIZE].tolist()
+
+    def get_dialogue_rows(self, dialogue_id: int) -> list:
+        """
+        Returns all the rows generated from a dialogue
+        :param dialogue_id:
+        :return:
+        """
+        if self.lookup_file_name is None:
+            raise ValueError('The rows of ' + self.file_name + ' cannot be accessed by dialogue without a lookup file')
+
+        if self.__dialogue_ranges is None:
+            self.__dialogue_ranges = self.__build_dialogue_ranges()
+
+        rows = []
+        for start, end in self.__dialogue_ranges.get(int(dialogue_id), []):
+            rows += self.get_rows(start, end)
+
+        return rows
+
+    def __build_dialogue_ranges(self) -> dict:
+        """
+        The rows of a dialogue are contiguous, so each dialogue is a single range of rows (unless the same dialogue
+        appears again further in the file)
+        :return:
+        """
+        run_starts = np.flatnonzero(np.diff(self.row_dialogue_ids) != 0) + 1
+        run_starts = np.concatenate(([0], run_starts)).astype(np.int64) if len(self) > 0 else run_starts
+        run_ends = np.append(run_starts[1:], len(self))
+
+        dialogue_ranges = {}
+        for dialogue_id, start, end in zip(self.row_dialogue_ids[run_starts].tolist(), run_starts.tolist(),
+                                           run_ends.tolist()):
+            dialogue_ranges.setdefault(dialogue_id, []).append((start, end))
+
+        return dialogue_ranges
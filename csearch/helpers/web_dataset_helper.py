@@ -1,4 +1,6 @@
 from csearch.helpers.bm25_helper import BM25Helper
+from csearch.helpers.dataset_helper import DatasetHelper
+from csearch.helpers.text_helper import TextHelper
 
 
 class WebDatasetHelper:
@@ -17,34 +19,62 @@ class WebDatasetHelper:
 
         return corpus
 
-    def __build_multi_topic_raw_web_document_corpus(self, json_data: dict) -> dict:
+    def __build_topic_document_indexes(self, json_data: dict) -> dict:
         """
-        Builds the web document corpus, which is used to generate additional dialogues using BM25
-        :return:
+        Groups the documents of the web document corpus (see __build_raw_web_document_corpus) by the topic of their
+        dialogue
+        :return: Dictionary topic -> indexes of its documents in the web document corpus, in order
         """
-        corpus = {}
+        document_indexes = {}
+        current_index = 0
 
         for (key, dialogue) in json_data.items():
-            topic = dialogue['category']
-            if topic not in corpus:
-                corpus[topic] = []
+            documents_count = len(self.__process_web_documents(dialogue))
+            document_indexes.setdefault(dialogue['category'], []).extend(
+                range(current_index, current_index + documents_count)
+            )
+            current_index += documents_count
 
-            corpus[topic] += (self.__process_web_documents(dialogue))
+        return document_indexes
 
-        return corpus
+    def build_bm25_helper(self, json_data: dict, index_folder: str = None, n_process: int = 1,
+                          count_duplicates: bool = False) -> BM25Helper:
+        """
+        Builds the bm25 helper of the web documents, indexing each crawled page once (see
+        DatasetHelper.build_corpus_bm25_helper)
+        :param json_data:
+        :param index_folder:
+        :param n_process:
+        :param count_duplicates:
+        :return:
+        """
+        bm25_helper, _ = DatasetHelper.build_corpus_bm25_helper(
+            self.__build_raw_web_document_corpus(json_data), index_folder, n_process, count_duplicates
+        )
 
-    def build_bm25_helper(self, json_data: dict) -> BM25Helper:
-        return BM25Helper(self.__build_raw_web_document_corpus(json_data))
+        return bm25_helper
 
-    def build_multi_topic_bm25_helper(self, json_data: dict) -> dict:
-        bm25_helper = {}
-        raw_document_corpus = self.__build_multi_topic_raw_web_document_corpus(json_data)
+    def build_multi_topic_bm25_helper(self, json_data: dict, index_folder: str = None, n_process: int = 1,
+                                      count_duplicates: bool = False) -> dict:
+        """
+        Builds one bm25 helper per topic, sharing the pre-processed corpus of build_bm25_helper (see
+        DatasetHelper.build_multi_topic_bm25_helper)
+        :param json_data:
+        :param index_folder:
+        :param n_process:
+        :param count_duplicates:
+        :return: Dictionary topic -> BM25Helper
+        """
+        corpus_bm25_helper, document_positions = DatasetHelper.build_corpus_bm25_helper(
+            self.__build_raw_web_document_corpus(json_data), index_folder, n_process, count_duplicates
+        )
 
-        for topic, entry in raw_document_corpus.items():
-            print('Building BM25 corpus for topic: ' + topic)
-            bm25_helper[topic] = BM25Helper(entry)
+        topic_document_indexes = {
+            topic: [document_positions[index] for index in document_indexes]
+            for topic, document_indexes in self.__build_topic_document_indexes(json_data).items()
+        }
 
-        return bm25_helper
+        return corpus_bm25_helper.build_subset_helpers(topic_document_indexes, corpus_bm25_helper.index_folder)
 
     def __process_web_documents(self, dialogue: dict) -> list:
         """
@@ -59,7 +89,7 @@ class WebDatasetHelper:
             )
         )
 
-        return [self.url_mapping[url]['text'].replace('\n', '.').replace('\r', '.') for utterance in valid_agent_utterances
+        return [TextHelper.flatten_document(self.url_mapping[url]['text']) for utterance in valid_agent_utterances
                 for url in list(filter(lambda url: url in self.url_mapping, utterance['urls']))]
 
     def is_valid_utterance(self, utterance):
@@ -1,2 +1,3 @@
 from csearch.models.json_dialogue import JsonDialogue
 from csearch.models.agent_utterance import AgentUtterance
+from csearch.models.utterance import Utterance
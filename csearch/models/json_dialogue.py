@@ -1,5 +1,23 @@
-import re
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
+from csearch.helpers.text_helper import TextHelper
+from csearch.models.utterance import Utterance
+
+# Minimum compound polarity of a final user utterance (feedback) for each category
+POLARITY_THRESHOLD = {
+    'apple': 0.3,
+    'askubuntu': 0.37,
+    'dba': 0.35,
+    'diy': 0,
+    'electronics': 0.06,
+    'english': 0.23,
+    'gaming': 0.07,
+    'gis': 0.35,
+    'physics': 0.54,
+    'scifi': 0,
+    'security': 0.28,
+    'stats': 0.48,
+    'travel': 0.17,
+    'worldbuilding': 0.58,
+}
 
 
 class JsonDialogue:
@@ -11,8 +29,10 @@ class JsonDialogue:
         - The utterances that were generated throughout the dialogue
         - Whether or not the dialogue had concatenated utterances (when the same users generated consecutive utterances)
     """
+    __slots__ = ('category', 'title', 'dialog_time', 'usernames', 'utterances', '__agent_utterances',
+                 'has_concatenated_utterances', 'sentiment_scorer')
 
-    def __init__(self, category: str, title: str, dialog_time, usernames, sid: SentimentIntensityAnalyzer):
+    def __init__(self, category: str, title: str, dialog_time, usernames, sentiment_scorer):
         self.category = category
         self.title = title
         self.dialog_time = dialog_time
@@ -20,28 +40,25 @@ class JsonDialogue:
         self.utterances = []
         self.__agent_utterances = []
         self.has_concatenated_utterances = 0
-        self.sid = sid
-        self.polarity_threshold = {
-            'apple': 0.3,
-            'askubuntu': 0.37,
-            'dba': 0.35,
-            'diy': 0,
-            'electronics': 0.06,
-            'english': 0.23,
-            'gaming': 0.07,
-            'gis': 0.35,
-            'physics': 0.54,
-            'scifi': 0,
-            'security': 0.28,
-            'stats': 0.48,
-            'travel': 0.17,
-            'worldbuilding': 0.58,
-        }
+        self.sentiment_scorer = sentiment_scorer
+
+    @classmethod
+    def from_question(cls, category: str, question: tuple, usernames, sentiment_scorer):
+        """
+        Creates an empty dialogue for a question record (any object with the DataFrame columns as attributes, such
+        as the namedtuples of DataFrame.itertuples)
+        :param category:
+        :param question:
+        :param usernames:
+        :param sentiment_scorer: The SentimentScorer used to check the final utterance
+        :return:
+        """
+        return cls(category, question.Title, question.CreationDate_post, usernames, sentiment_scorer)
 
     def __build_agent_utterances(self):
         self.__agent_utterances = list(
             filter(
-                lambda utterance: utterance['actor_type'] == 'agent', self.utterances
+                lambda utterance: utterance.actor_type == 'agent', self.utterances
             )
         )
 
@@ -55,10 +72,20 @@ class JsonDialogue:
             'category': self.category,
             'title': self.title,
             'dialog_time': self.dialog_time,
-            'utterances': self.utterances,
+            'utterances': [utterance.as_dict() for utterance in self.utterances],
             'has_concatenated_utterances': self.has_concatenated_utterances,
         }
 
+    def release_filter_state(self) -> None:
+        """
+        Drops the references that are only needed while the dialogue is being filtered, so that accepted dialogues
+        stay small (and cheap to send between processes)
+        :return:
+        """
+        self.usernames = None
+        self.sentiment_scorer = None
+        self.__agent_utterances = []
+
     def __is_other_mention(self, text: str) -> bool:
         """
         Checks whether a comment contains a mention referring some other users than the ones participating in the
@@ -83,21 +110,20 @@ class JsonDialogue:
         :param text:
         :return:
         """
-        clean_text = re.sub('<(?!a)(?!br)(?!blockquote)(?!pre)(?!code)(?!/blockquote)(?!/pre)(?!/code).*?>', '', text)\
-            .replace('\n', '').replace('\r', '').replace('\t', '')
+        clean_text = TextHelper.strip_html(text)
 
         return clean_text if clean_text else '<Placeholder Response>'
 
     @classmethod
     def __format_utterance(cls,
-                           utterance: dict,
+                           utterance: tuple,
                            current_position: int,
                            is_agent: bool = False,
                            is_comment: bool = False,
-                           is_accepted: bool = False) -> dict:
+                           is_accepted: bool = False) -> Utterance:
         """
         Given an utterance, this function formats it similar to this https://ciir.cs.umass.edu/downloads/msdialog/
-        :param utterance: The current utterance to be formatted
+        :param utterance: The current utterance to be formatted (post/comment record)
         :param current_position: The position of the current utterance
         :param is_agent: True if the utterance has been emitted by an agent
         :param is_comment: True if the utterance is a comment
@@ -108,31 +134,31 @@ class JsonDialogue:
         actor_type = 'agent' if is_agent else 'user'
 
         if is_comment:
-            return {
-                'utterance': JsonDialogue.__process_text(utterance['Text']),
-                'utterance_time': utterance['CreationDate_comment'],
-                'utterance_pos': current_position,
-                'actor_type': actor_type,
-                'user_name': utterance['DisplayName_comment'],
-                'user_id': utterance['UserId'],
-                'votes': utterance['Score_comment'],
-                'id': str(utterance['Id_post']) + '-' + str(utterance['Id_comment']),
-                'is_answer': 0
-            }
+            return Utterance(
+                JsonDialogue.__process_text(utterance.Text),
+                utterance.CreationDate_comment,
+                current_position,
+                actor_type,
+                utterance.DisplayName_comment,
+                utterance.UserId,
+                utterance.Score_comment,
+                str(utterance.Id_post) + '-' + str(utterance.Id_comment),
+                0
+            )
 
-        return {
-            'utterance': JsonDialogue.__process_text(utterance['Body']),
-            'utterance_time': utterance['CreationDate_post'],
-            'utterance_pos': current_position,
-            'actor_type': actor_type,
-            'user_name': utterance['DisplayName_post'],
-            'user_id': utterance['OwnerUserId'],
-            'votes': utterance['Score_post'],
-            'id': str(utterance['Id_post']),
-            'is_answer': 1 if is_accepted else 0
-        }
+        return Utterance(
+            JsonDialogue.__process_text(utterance.Body),
+            utterance.CreationDate_post,
+            current_position,
+            actor_type,
+            utterance.DisplayName_post,
+            utterance.OwnerUserId,
+            utterance.Score_post,
+            str(utterance.Id_post),
+            1 if is_accepted else 0
+        )
 
-    def append_utterance(self, original_post: dict, response: dict, is_accepted: bool=False) -> None:
+    def append_utterance(self, original_post: tuple, response: tuple, is_accepted: bool=False) -> None:
         """
         Appends the utterance(s) to the dialog
         :param original_post: The original question
@@ -157,14 +183,14 @@ class JsonDialogue:
             current_position = len(self.utterances) + 1
 
         # The original user posted a comment
-        if response['UserId'] == original_post['OwnerUserId']:
-                # and ~self.__is_other_mention(response['Text']):
+        if response.UserId == original_post.OwnerUserId:
+                # and ~self.__is_other_mention(response.Text):
             self.utterances.append(
                 self.__format_utterance(response, current_position, is_agent=False, is_comment=True)
             )
             current_position += 1
-        # Other users commented. If the response['Text'] is a float, that means it's not a comment
-        elif not isinstance(response['Text'], float):
+        # Other users commented. If the response.Text is a float, that means it's not a comment
+        elif not isinstance(response.Text, float):
             self.utterances.append(
                 self.__format_utterance(response, current_position, is_agent=True, is_comment=True)
             )
@@ -178,7 +204,7 @@ class JsonDialogue:
         """
         current_position = 1
         for utterance in utterances:
-            utterance['utterance_pos'] = current_position
+            utterance.utterance_pos = current_position
             current_position += 1
 
     def concat_consecutive_same_person_comments(self) -> None:
@@ -193,13 +219,13 @@ class JsonDialogue:
         utterances = self.utterances
 
         while i < len(utterances) - 1:
-            last_user_id = utterances[i]['user_id']
-            utterance = utterances[i]['utterance']
+            last_user_id = utterances[i].user_id
+            utterance = utterances[i].utterance
 
             j = i + 1
-            current_user_id = utterances[j]['user_id']
+            current_user_id = utterances[j].user_id
             while last_user_id == current_user_id:
-                utterance += utterances[j]['utterance']
+                utterance += utterances[j].utterance
                 are_concatenated_comments = True
                 indexes_to_remove.append(j)
 
@@ -208,9 +234,9 @@ class JsonDialogue:
                 if j >= len(utterances):
                     break
 
-                current_user_id = utterances[j]['user_id']
+                current_user_id = utterances[j].user_id
 
-            utterances[i]['utterance'] = utterance
+            utterances[i].utterance = utterance
             i = j
 
         for i in sorted(indexes_to_remove, reverse=True):
@@ -221,17 +247,24 @@ class JsonDialogue:
             self.utterances = utterances
             self.has_concatenated_utterances = 1
 
-    def is_feedback_final_response(self) -> bool:
+    def is_feedback_final_response(self, polarity_score: float = None) -> bool:
+        """
+        :param polarity_score: Compound polarity of the final utterance, when it was already scored (e.g. in a batch,
+        see DialogueFilterPipeline). Otherwise, it is scored here
+        :return:
+        """
         last_utterance = self.utterances[-1]
-        polarity_score = self.sid.polarity_scores(last_utterance['utterance'])['compound']
 
-        if last_utterance['actor_type'] == 'user':
-            return polarity_score >= self.polarity_threshold[self.category]
+        if last_utterance.actor_type == 'user':
+            if polarity_score is None:
+                polarity_score = self.sentiment_scorer.score(last_utterance.utterance)
+
+            return polarity_score >= POLARITY_THRESHOLD[self.category]
 
         return True
 
     def is_two_way(self) -> bool:
-        agents = set([utterance['user_id'] for utterance in self.utterances])
+        agents = set([utterance.user_id for utterance in self.utterances])
 
         if len(agents) > 2:
             return False
@@ -244,11 +277,7 @@ class JsonDialogue:
 
         # Check if at least one agent utterance is grounded (contains link)
         for agent_utterance in self.__agent_utterances:
-            urls = re.findall(
-                'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\), ]|(?:%[0-9a-fA-F][0-9a-fA-F]))+',
-                agent_utterance['utterance']
-            )
-            if 'href' in agent_utterance['utterance'] or len(urls) > 0:
+            if TextHelper.is_grounded(agent_utterance.utterance):
                 return True
 
         return False
@@ -268,7 +297,7 @@ class JsonDialogue:
             self.__build_agent_utterances()
 
         for utterance in self.__agent_utterances:
-            lower_utt = utterance['utterance'].lower()
+            lower_utt = utterance.utterance.lower()
             if 'edit:' in lower_utt or 'deprecated:' in lower_utt:
                 return True
 
@@ -0,0 +1,32 @@
+class Utterance:
+    """
+    A single utterance of a JsonDialogue. The attributes are stored in slots instead of a per-instance dictionary,
+    since a topic holds millions of utterances. The dictionary representation is only built by as_dict
+    """
+    __slots__ = ('utterance', 'utterance_time', 'utterance_pos', 'actor_type', 'user_name', 'user_id', 'votes', 'id',
+                 'is_answer')
+
+    def __init__(self, utterance: str, utterance_time, utterance_pos: int, actor_type: str, user_name, user_id, votes,
+                 id: str, is_answer: int):
+        self.utterance = utterance
+        self.utterance_time = utterance_time
+        self.utterance_pos = utterance_pos
+        self.actor_type = actor_type
+        self.user_name = user_name
+        self.user_id = user_id
+        self.votes = votes
+        self.id = id
+        self.is_answer = is_answer
+
+    def as_dict(self) -> dict:
+        return {
+            'utterance': self.utterance,
+            'utterance_time': self.utterance_time,
+            'utterance_pos': self.utterance_pos,
+            'actor_type': self.actor_type,
+            'user_name': self.user_name,
+            'user_id': self.user_id,
+            'votes': self.votes,
+            'id': self.id,
+            'is_answer': self.is_answer,
+        }
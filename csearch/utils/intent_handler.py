@@ -42,6 +42,17 @@ def merge_intent_to_json_dataset(dataset_file: str, intent_file: str, split: str
         json.dump(dataset_data, output_f)
 
 
+def iter_lookup_file(training_lookup_file: str):
+    """
+    Generates the dialogue IDs of a lookup file (one per row of its training .tsv), as strings, in order
+    :param training_lookup_file:
+    :return:
+    """
+    with open(training_lookup_file, 'r') as training_lookup_f:
+        for line in training_lookup_f:
+            yield line.rstrip('\n')
+
+
 def generate_intent_mtl_training_from_training_set(dataset_location: str, training_lookup_location: str, samples_per_context: int):
     """
     Generates the intent file for training based on the lookup of the Main Training file.
@@ -63,20 +74,16 @@ def generate_intent_mtl_training_from_training_set(dataset_location: str, traini
         with open(dataset_file, 'r') as dataset_f:
             dataset_data = json.load(dataset_f)
 
-        lookup_data = []
         training_lookup_file = training_lookup_location + '/data_' + allocation + '_web_hard_lookup.txt'
         training_lookup_files[allocation] = training_lookup_file
 
-        with open(training_lookup_file, 'r') as training_lookup_f:
-            rows = csv.reader(training_lookup_f)
-            for row in rows:
-                lookup_data.append(row[0])
-
-        current_index = lookup_data[0]
+        current_index = None
         occurrences = 0
         current_last_utterance = initial_last_utterance
 
-        for entry in lookup_data:
+        # The lookup file is streamed line by line, instead of being loaded in a list. Only the dialogue IDs are
+        # needed, so the training tsv itself is never read
+        for entry in iter_lookup_file(training_lookup_file):
             if entry != current_index:
                 current_index = entry
                 occurrences = 0
@@ -6,21 +6,29 @@ import os
 import sys
 
 
-def build_json(dump_folder: str, topic: str):
+def build_json(dump_folder: str, topic: str, num_workers: int = 1):
     dataset_split = {
         'train': 0.7,
         'dev': 0.15,
         'test': 0.15,
     }
-    StackExchangeJSONBuilder(dump_folder, topic).build_json(dataset_split)
+    StackExchangeJSONBuilder(dump_folder, topic, num_workers=num_workers).build_json(dataset_split)
 
 
-def build_training(dump_folder: str, difficulty: str):
-    TrainingSetBuilder(dump_folder).build(difficulty == 'easy')
+def build_training(dump_folder: str, difficulty: str, num_workers: int = 1, options: list = ()):
+    TrainingSetBuilder(
+        dump_folder, num_workers, 'count_duplicates' in options, output_format=get_output_format(options)
+    ).build(difficulty == 'easy', 'resume' in options)
 
 
-def build_web_training(dump_folder: str, difficulty: str):
-    WebTrainingSetBuilder(dump_folder).build(difficulty == 'easy')
+def build_web_training(dump_folder: str, difficulty: str, num_workers: int = 1, options: list = ()):
+    WebTrainingSetBuilder(
+        dump_folder, num_workers, 'count_duplicates' in options, output_format=get_output_format(options)
+    ).build(difficulty == 'easy', 'resume' in options)
+
+
+def get_output_format(options: list) -> str:
+    return 'binary' if 'binary' in options else 'tsv'
 
 
 def merge_topics(topics: list):
@@ -51,22 +59,27 @@ if __name__ == "__main__":
         switch[mode](arg_topics)
         exit(1)
 
-    if mode == 'training':
+    if mode in ['training', 'web_training']:
         difficulty = 'normal'
-        if len(sys.argv) == 3:
+        if len(sys.argv) >= 3:
             difficulty = sys.argv[2]
 
-        dump_folder = os.path.dirname(os.path.abspath(__file__)) + '/stackexchange_dump'
-        switch[mode](dump_folder, difficulty)
-        exit(1)
+        num_workers = 1
+        if len(sys.argv) >= 4:
+            num_workers = int(sys.argv[3])
 
-    if mode == 'web_training':
-        difficulty = 'normal'
-        if len(sys.argv) == 3:
-            difficulty = sys.argv[2]
+        # Any of: resume, binary (output format), count_duplicates (BM25 statistics)
+        options = sys.argv[4:]
+        allowed_options = ['resume', 'binary', 'count_duplicates']
+        if any(option not in allowed_options for option in options):
+            print("ERROR: Unknown option. Must be from [" + " | ".join(allowed_options) + "]")
+            exit(-1)
+
+        dump_folder = os.path.dirname(os.path.abspath(__file__)) + '/stackexchange_dump'
+        if mode == 'web_training':
+            dump_folder += '/mantis_web/'
 
-        dump_folder = os.path.dirname(os.path.abspath(__file__)) + '/stackexchange_dump/mantis_web/'
-        switch[mode](dump_folder, difficulty)
+        switch[mode](dump_folder, difficulty, num_workers, options)
         exit(1)
 
     topic = sys.argv[2]
@@ -90,5 +103,9 @@ if __name__ == "__main__":
         print("ERROR: The files for the chosen topic do not exist")
         exit(-1)
 
-    switch[mode](dump_folder, topic)
+    num_workers = 1
+    if len(sys.argv) == 4:
+        num_workers = int(sys.argv[3])
+
+    switch[mode](dump_folder, topic, num_workers)
 